@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def eager_background_jobs(settings):
+    """Фоновые задачи выполняются в потоке теста и не переживают его базу."""
+    settings.BACKGROUND_JOBS_EAGER = True
@@ -0,0 +1,389 @@
+import math
+import os
+import pickle
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+from django.core.cache import cache as default_cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# L1 общий для всех потоков процесса: django создаёт объект кэша на поток.
+_stores = {}
+_locks = {}
+
+_missing = object()
+
+RECOMPUTE_LOCK_TIMEOUT = 30
+RECOMPUTE_WAIT = 2
+RECOMPUTE_POLL = 0.05
+
+
+class TwoTierCache(BaseCache):
+    """
+    Двухуровневый кэш: маленький LRU в памяти процесса (L1) перед общим
+    для всех воркеров хоста кэшем (L2) из отдельного алиаса CACHES.
+
+    Записи L1 живут не дольше L1_TIMEOUT секунд, поэтому изменения из
+    других воркеров видны с этой задержкой. Ключи с префиксами из
+    L1_BYPASS (например, поколения кэша страниц) всегда читаются из L2:
+    они меняются при записи данных и сами служат метками версий для
+    остальных ключей.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._l1_timeout = options.get('L1_TIMEOUT', 5)
+        self._l1_max_entries = options.get('L1_MAX_ENTRIES', 1000)
+        self._l1_bypass = tuple(options.get('L1_BYPASS', ()))
+        self._l1 = _stores.setdefault(name, OrderedDict())
+        self._lock = _locks.setdefault(name, Lock())
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _l1_key(self, key, version):
+        if key.startswith(self._l1_bypass):
+            return None
+        return self.make_key(key, version=version)
+
+    def _l1_get(self, l1_key):
+        with self._lock:
+            entry = self._l1.get(l1_key)
+            if entry is None:
+                return _missing
+            expires, pickled = entry
+            if expires < time.monotonic():
+                del self._l1[l1_key]
+                return _missing
+            self._l1.move_to_end(l1_key)
+        return pickle.loads(pickled)
+
+    def _l1_set(self, l1_key, value, timeout=DEFAULT_TIMEOUT):
+        if l1_key is None:
+            return
+        ttl = self._l1_timeout
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is not None:
+            ttl = min(ttl, timeout - time.time())
+        if ttl <= 0:
+            self._l1_delete(l1_key)
+            return
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            self._l1[l1_key] = (time.monotonic() + ttl, pickled)
+            self._l1.move_to_end(l1_key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, l1_key):
+        if l1_key is None:
+            return
+        with self._lock:
+            self._l1.pop(l1_key, None)
+
+    def get(self, key, default=None, version=None):
+        l1_key = self._l1_key(key, version)
+        if l1_key is not None:
+            value = self._l1_get(l1_key)
+            if value is not _missing:
+                return value
+        value = self.l2.get(key, _missing, version=version)
+        if value is _missing:
+            return default
+        self._l1_set(l1_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            l1_key = self._l1_key(key, version)
+            value = _missing if l1_key is None else self._l1_get(l1_key)
+            if value is _missing:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            fetched = self.l2.get_many(remote, version=version)
+            for key, value in fetched.items():
+                self._l1_set(self._l1_key(key, version), value)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        self._l1_set(self._l1_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(self._l1_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(self._l1_key(key, version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        l1_key = self._l1_key(key, version)
+        self._l1_delete(l1_key)
+        return self.l2.incr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self._l1_key(key, version))
+        self.l2.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        l1_key = self._l1_key(key, version)
+        if l1_key is not None and self._l1_get(l1_key) is not _missing:
+            return True
+        return self.l2.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self.l2.clear()
+
+
+class SQLiteCache(BaseCache):
+    """
+    Общий для воркеров хоста кэш в файле SQLite (LOCATION). add и incr
+    атомарны между процессами: каждая операция - одна транзакция с
+    блокировкой записи. Целые числа хранятся как есть, чтобы incr
+    прибавлял их в самом UPDATE, остальные значения - в pickle.
+
+    Просроченные записи не читаются, а удаляются чисткой. Она
+    запускается в среднем раз в CULL_EVERY записей и, если записей больше
+    MAX_ENTRIES, удаляет ещё 1/CULL_FREQUENCY самых давно записанных.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._cull_every = params.get('OPTIONS', {}).get('CULL_EVERY', 100)
+        self._db = None
+        self._pid = None
+
+    @property
+    def db(self):
+        # Объект кэша свой у каждого потока, но после fork соединение
+        # родителя использовать нельзя.
+        if self._db is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self._path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(
+                self._path, timeout=5, isolation_level=None,
+                check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+                'value BLOB NOT NULL, expires REAL)')
+            self._pid = os.getpid()
+        return self._db
+
+    @contextmanager
+    def _write(self):
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _dump(self, value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _load(self, stored):
+        if isinstance(stored, int):
+            return stored
+        return pickle.loads(stored)
+
+    def _rows(self, timeout, data):
+        expires = self.get_backend_timeout(timeout)
+        return [(key, self._dump(value), expires) for key, value in data]
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self.db.execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())).fetchone()
+        return default if row is None else self._load(row[0])
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        if not made:
+            return {}
+        placeholders = ', '.join('?' * len(made))
+        rows = self.db.execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            [*made, time.time()])
+        return {made[key]: self._load(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = self._rows(timeout, (
+            (self._key(key, version), value) for key, value in data.items()))
+        with self._write() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', rows)
+        if random.random() * self._cull_every < len(rows):
+            self.cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        (row,) = self._rows(timeout, [(self._key(key, version), value)])
+        with self._write() as db:
+            db.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (row[0], time.time()))
+            added = db.execute(
+                'INSERT OR IGNORE INTO cache VALUES (?, ?, ?)', row).rowcount
+        return bool(added)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            db.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, key, time.time()))
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+        if row is None:
+            raise ValueError(f"Key '{key}' not found")
+        if not isinstance(row[0], int):
+            raise TypeError(f"Value of key '{key}' is not an integer")
+        return row[0]
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            touched = db.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time()))
+        return bool(touched.rowcount)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [(self._key(key, version),) for key in keys]
+        with self._write() as db:
+            db.executemany('DELETE FROM cache WHERE key = ?', keys)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        with self._write() as db:
+            db.execute('DELETE FROM cache')
+
+    def cull(self):
+        with self._write() as db:
+            db.execute(
+                'DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            (count,) = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+            if count > self._max_entries:
+                culled = count // self._cull_frequency if (
+                    self._cull_frequency) else count
+                db.execute(
+                    'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM '
+                    'cache ORDER BY rowid LIMIT ?)', (culled,))
+
+    def close(self, **kwargs):
+        # Соединение живёт дольше запроса: его открытие стоит дороже
+        # самих операций с кэшем.
+        pass
+
+
+def get_or_recompute(key, compute, timeout, cache=None, beta=1.0):
+    """
+    Чтение из кэша с защитой от лавины промахов.
+
+    Значение хранится вместе со сроком свежести и временем, которое ушло на
+    его вычисление. Незадолго до истечения срока значение с растущей
+    вероятностью пересчитывается заранее (probabilistic early expiration),
+    а пересчитывает его только тот, кто взял блокировку: остальные в это
+    время получают прежнее значение, которое живёт в кэше ещё один timeout.
+    Если значения нет совсем, остальные недолго ждут результата.
+
+    Когда compute возвращает None, результат не кэшируется.
+    """
+    cache = cache or default_cache
+    lock_key = f'{key}:lock'
+    envelope = cache.get(key)
+    if envelope is not None and not _should_recompute(envelope, beta):
+        return envelope[0]
+
+    if not cache.add(lock_key, 1, RECOMPUTE_LOCK_TIMEOUT):
+        if envelope is not None:
+            return envelope[0]
+        deadline = time.monotonic() + RECOMPUTE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(RECOMPUTE_POLL)
+            envelope = cache.get(key)
+            if envelope is not None:
+                return envelope[0]
+        return compute()
+
+    try:
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        if value is not None:
+            fresh_until = None if timeout is None else time.time() + timeout
+            cache.set(
+                key, (value, fresh_until, delta),
+                None if timeout is None else timeout * 2)
+        return value
+    finally:
+        cache.delete(lock_key)
+
+
+def _should_recompute(envelope, beta):
+    _, fresh_until, delta = envelope
+    if fresh_until is None:
+        return False
+    jitter = -delta * beta * math.log(random.random() or 1e-12)
+    return time.time() + jitter >= fresh_until
@@ -0,0 +1,53 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from posts.caching import card_generations, get_generations
+from posts.thumbnails import prefetch_thumbnails
+
+register = template.Library()
+
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+CARD_TEMPLATE = 'includes/post_item.html'
+
+
+def card_key(post, show_group, generations=None):
+    """
+    Ключ карточки: пост, время его изменения и поколения его автора и
+    группы, которые меняются при смене их имени или адреса.
+    """
+    scopes = card_generations(post)
+    if generations is None:
+        generations = dict(zip(scopes, get_generations(*scopes)))
+    return 'post_card:{}:{}:{}:{}'.format(
+        post.pk, post.modified.timestamp(), int(show_group),
+        '-'.join(str(generations[scope]) for scope in scopes))
+
+
+@register.simple_tag
+def post_cards(posts, group=True):
+    """
+    Отрендеренные карточки постов страницы. Каждая карточка кэшируется
+    отдельно под ключом из id поста, времени его изменения и поколений
+    автора и группы, все карточки страницы читаются одним get_many, а
+    рендерятся только отсутствующие; их миниатюры собираются одним
+    запросом к хранилищу sorl.
+    """
+    posts = list(posts)
+    scopes = list({
+        scope: None for post in posts for scope in card_generations(post)})
+    generations = dict(zip(scopes, get_generations(*scopes)))
+    keys = [card_key(post, group, generations) for post in posts]
+    cards = cache.get_many(keys)
+    missing = {}
+    stale = [post for key, post in zip(keys, posts) if key not in cards]
+    prefetch_thumbnails(stale)
+    card_template = get_template(CARD_TEMPLATE)
+    for key, post in zip(keys, posts):
+        if key not in cards:
+            cards[key] = missing[key] = card_template.render(
+                {'post': post, 'show_group': group})
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+    return [mark_safe(cards[key]) for key in keys]
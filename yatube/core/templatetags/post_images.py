@@ -0,0 +1,75 @@
+from django import template
+
+from posts.thumbnails import ready_thumbnail
+
+register = template.Library()
+
+PICTURE_SIZES = '(max-width: 992px) 100vw, 960px'
+FALLBACK_WIDTH = 960
+
+
+@register.simple_tag
+def post_thumbnail(post, size='card'):
+    """
+    Готовая миниатюра картинки поста, а пока её нет - сама картинка.
+    Миниатюры страницы заранее собирает prefetch_thumbnails, и тег берёт
+    их из post.thumbnails; без него - читает хранилище sorl. Картинки тег
+    никогда не обрабатывает.
+    """
+    if not post.image:
+        return None
+    if hasattr(post, 'thumbnails'):
+        thumbnail = post.thumbnails.get(size)
+    else:
+        thumbnail = ready_thumbnail(post.image, size)
+    return thumbnail or post.image
+
+
+@register.inclusion_tag('includes/post_picture.html')
+def post_picture(post, lazy=True):
+    """
+    <picture> со srcset по вариантам, записанным в посте. Адреса
+    собираются из имён файлов, без обращений к хранилищу; пока вариантов
+    нет, выводится миниатюра или исходная картинка.
+    """
+    context = {'lazy': lazy, 'sizes': PICTURE_SIZES}
+    variants = post.variants if post.image else {}
+    if not variants:
+        image = post_thumbnail(post)
+        if image is None:
+            context['src'] = None
+        elif image is post.image:
+            # Размеры исходника записаны в посте: файл не открывается.
+            context.update({
+                'src': image.url,
+                'width': post.image_width,
+                'height': post.image_height,
+            })
+        else:
+            context.update({
+                'src': image.url, 'width': image.width,
+                'height': image.height})
+        return context
+    storage = post.image.storage
+    sources = []
+    for image_format, entries in variants.items():
+        sources.append({
+            'type': f'image/{image_format.lower()}',
+            'srcset': ', '.join(
+                f'{storage.url(name)} {width}w'
+                for width, height, name in entries),
+            'entries': entries,
+        })
+    fallback = sources.pop()
+    entries = fallback['entries']
+    width, height, name = next(
+        (entry for entry in reversed(entries)
+         if entry[0] <= FALLBACK_WIDTH), entries[0])
+    context.update({
+        'sources': sources,
+        'src': storage.url(name),
+        'srcset': fallback['srcset'],
+        'width': width,
+        'height': height,
+    })
+    return context
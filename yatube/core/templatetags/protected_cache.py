@@ -0,0 +1,38 @@
+from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags import cache as cache_tags
+
+from core.cache import get_or_recompute
+
+register = template.Library()
+
+
+class ProtectedCacheNode(cache_tags.CacheNode):
+    """{% cache %}, который пересчитывает фрагмент в одном потоке."""
+
+    def render(self, context):
+        expire_time = self.expire_time_var.resolve(context)
+        if expire_time is not None:
+            expire_time = int(expire_time)
+        if self.cache_name:
+            fragment_cache = caches[self.cache_name.resolve(context)]
+        else:
+            try:
+                fragment_cache = caches['template_fragments']
+            except InvalidCacheBackendError:
+                fragment_cache = caches['default']
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        cache_key = make_template_fragment_key(self.fragment_name, vary_on)
+        return get_or_recompute(
+            cache_key, lambda: self.nodelist.render(context),
+            expire_time, cache=fragment_cache)
+
+
+@register.tag('cache')
+def do_cache(parser, token):
+    """Тот же синтаксис, что и у {% cache %} из {% load cache %}."""
+    node = cache_tags.do_cache(parser, token)
+    return ProtectedCacheNode(
+        node.nodelist, node.expire_time_var, node.fragment_name,
+        node.vary_on, node.cache_name)
@@ -0,0 +1,18 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class EagerJobsRunner(DiscoverRunner):
+    """
+    Запускает тесты с BACKGROUND_JOBS_EAGER: фоновые задачи выполняются
+    в потоке теста и не переживают его базу и временные каталоги.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.eager_jobs = override_settings(BACKGROUND_JOBS_EAGER=True)
+        self.eager_jobs.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.eager_jobs.disable()
+        super().teardown_test_environment(**kwargs)
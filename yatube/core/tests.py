@@ -0,0 +1,196 @@
+import os
+import shutil
+import tempfile
+from threading import Thread
+from unittest import mock
+
+from django.core.cache import caches
+from django.template import Context, Template
+from django.test import SimpleTestCase
+
+from .cache import SQLiteCache, TwoTierCache, get_or_recompute
+
+
+class TwoTierCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = TwoTierCache('test-two-tier', {'OPTIONS': {
+            'L2': 'shared',
+            'L1_TIMEOUT': 60,
+            'L1_MAX_ENTRIES': 2,
+            'L1_BYPASS': ('generation:',),
+        }})
+        self.cache.clear()
+        self.l2 = caches['shared']
+
+    def test_hot_keys_are_served_from_l1(self):
+        """Повторное чтение ключа не обращается к общему кэшу."""
+        self.cache.set('post', 'текст')
+        with mock.patch.object(self.l2, 'get') as l2_get:
+            self.assertEqual(self.cache.get('post'), 'текст')
+        l2_get.assert_not_called()
+
+    def test_l1_fills_from_l2_written_by_other_worker(self):
+        """Значение, записанное другим воркером, читается из L2."""
+        self.l2.set('post', 'из другого воркера')
+        self.assertEqual(self.cache.get('post'), 'из другого воркера')
+        self.assertEqual(
+            self.cache.get_many(['post', 'missing']),
+            {'post': 'из другого воркера'})
+
+    def test_l1_entries_expire(self):
+        """Записи L1 живут не дольше L1_TIMEOUT."""
+        self.cache.set('post', 'старое')
+        self.l2.set('post', 'новое')
+        with mock.patch('core.cache.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(self.cache.get('post'), 'новое')
+
+    def test_l1_is_bounded_lru(self):
+        """L1 вытесняет давно не читанные ключи."""
+        for key in ('first', 'second', 'third'):
+            self.cache.set(key, key)
+        self.l2.delete('first')
+        self.l2.delete('third')
+        self.assertIsNone(self.cache.get('first'))
+        self.assertEqual(self.cache.get('third'), 'third')
+
+    def test_bypassed_keys_are_always_read_from_l2(self):
+        """Метки версий всегда читаются из общего кэша."""
+        self.cache.set('generation:index', 1)
+        self.l2.set('generation:index', 2)
+        self.assertEqual(self.cache.get('generation:index'), 2)
+
+    def test_incr_and_delete_reach_l2(self):
+        """incr и delete меняют значение и в L1, и в L2."""
+        self.cache.set('count', 1)
+        self.assertEqual(self.cache.incr('count'), 2)
+        self.assertEqual(self.cache.get('count'), 2)
+        self.cache.delete('count')
+        self.assertIsNone(self.l2.get('count'))
+        self.assertIsNone(self.cache.get('count'))
+
+
+class SQLiteCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.cache = self.worker()
+
+    def worker(self, **options):
+        """Свой объект кэша, как у другого воркера: своё соединение."""
+        return SQLiteCache(os.path.join(self.directory, 'cache.sqlite3'), {
+            'TIMEOUT': None, 'OPTIONS': options})
+
+    def test_values_are_shared_between_workers(self):
+        """Записанное одним воркером читает другой."""
+        self.cache.set_many({'post': {'text': 'текст'}, 'count': 3})
+        self.assertEqual(self.worker().get_many(['post', 'count', 'x']), {
+            'post': {'text': 'текст'}, 'count': 3})
+
+    def test_add_succeeds_once(self):
+        """add срабатывает у одного воркера, пока запись не истекла."""
+        other = self.worker()
+        self.assertTrue(self.cache.add('lock', 1, 30))
+        self.assertFalse(other.add('lock', 2, 30))
+        self.assertEqual(other.get('lock'), 1)
+        with mock.patch('core.cache.time.time', return_value=10 ** 10):
+            self.assertTrue(other.add('lock', 2, 30))
+
+    def test_concurrent_incr_loses_no_updates(self):
+        """Одновременные incr разных воркеров не теряют приращений."""
+        self.cache.set('count', 0)
+
+        def increment():
+            worker = self.worker()
+            for _ in range(50):
+                worker.incr('count')
+
+        threads = [Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('count'), 200)
+
+    def test_incr_of_missing_key_fails(self):
+        """incr отсутствующего ключа - ValueError, как у кэшей django."""
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expired_entries_are_hidden_and_culled(self):
+        """Просроченные записи не читаются и удаляются чисткой."""
+        cache = self.worker(MAX_ENTRIES=2, CULL_FREQUENCY=2)
+        cache.set('old', 1, 1)
+        with mock.patch('core.cache.time.time', return_value=10 ** 10):
+            self.assertIsNone(cache.get('old'))
+            self.assertFalse(cache.has_key('old'))
+            for key in ('first', 'second', 'third', 'fourth'):
+                cache.set(key, key)
+            cache.cull()
+        self.assertEqual(
+            cache.get_many(['old', 'first', 'second', 'third', 'fourth']),
+            {'third': 'third', 'fourth': 'fourth'})
+
+
+class GetOrRecomputeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches['shared']
+        self.cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'значение {self.calls}'
+
+    def test_fresh_value_is_not_recomputed(self):
+        """Свежее значение вычисляется один раз."""
+        for _ in range(3):
+            value = get_or_recompute('key', self.compute, 60, self.cache)
+        self.assertEqual(value, 'значение 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_while_locked(self):
+        """Пока значение пересчитывает другой процесс, отдаётся старое."""
+        self.cache.set('key', ('старое', 0, 0))
+        self.cache.add('key:lock', 1)
+        value = get_or_recompute('key', self.compute, 60, self.cache)
+        self.assertEqual(value, 'старое')
+        self.assertEqual(self.calls, 0)
+
+    def test_expiring_value_is_recomputed_by_lock_holder(self):
+        """Устаревшее значение пересчитывает взявший блокировку."""
+        self.cache.set('key', ('старое', 0, 0))
+        value = get_or_recompute('key', self.compute, 60, self.cache)
+        self.assertEqual(value, 'значение 1')
+        self.assertIsNone(self.cache.get('key:lock'))
+
+    def test_cold_miss_waits_for_lock_holder(self):
+        """При пустом кэше ждём результата того, кто его вычисляет."""
+        self.cache.add('key:lock', 1)
+
+        def fill(seconds):
+            self.cache.set('key', ('готово', None, 0))
+
+        with mock.patch('core.cache.time.sleep', side_effect=fill):
+            value = get_or_recompute('key', self.compute, 60, self.cache)
+        self.assertEqual(value, 'готово')
+        self.assertEqual(self.calls, 0)
+
+    def test_none_is_not_cached(self):
+        """Результат None не попадает в кэш."""
+        get_or_recompute('key', lambda: None, 60, self.cache)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_fragment_tag(self):
+        """{% cache %} из protected_cache кэширует фрагмент."""
+        template = Template(
+            '{% load protected_cache %}'
+            '{% cache 60 fragment name %}{{ value }}{% endcache %}')
+        self.assertEqual(
+            template.render(Context({'name': 'a', 'value': 1})), '1')
+        self.assertEqual(
+            template.render(Context({'name': 'a', 'value': 2})), '1')
+        self.assertEqual(
+            template.render(Context({'name': 'b', 'value': 2})), '2')
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Post, Group, Comment
+from .search import has_search_index, match_expression, match_ids_sql
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -9,6 +10,16 @@ class PostAdmin(admin.ModelAdmin):
     list_editable = ('group',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not has_search_index() or not match_expression(search_term):
+            return super().get_search_results(
+                request, queryset, search_term)
+        sql, params = match_ids_sql(search_term)
+        pk_column = '{}.{}'.format(
+            queryset.model._meta.db_table, queryset.model._meta.pk.column)
+        return queryset.extra(
+            where=[f'{pk_column} IN ({sql})'], params=params), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -0,0 +1,266 @@
+import heapq
+import logging
+import time
+from bisect import bisect_left, bisect_right
+from threading import Lock, Thread
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from .models import Group
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_LIMIT = 10
+# Префиксы, которым подходит больше стольких ключей, ранжируются заранее:
+# для них индекс хранит готовую первую страницу выдачи.
+AUTOCOMPLETE_SCAN = 2000
+
+USER = 'user'
+GROUP = 'group'
+
+
+class PrefixIndex:
+    """
+    Отсортированный массив ключей с бинарным поиском по префиксу. Ключ -
+    строка в нижнем регистре, запись - (вид, идентификатор); у записи
+    есть ранг (число подписчиков или постов) и подпись для выдачи.
+
+    Для частых префиксов (больше AUTOCOMPLETE_SCAN ключей) хранится
+    готовый список лучших записей, остальные ранжируются просмотром
+    всех совпадений, так что выдача всегда упорядочена по рангу.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._keys = []
+        self._entries = []
+        self._ranks = {}
+        self._labels = {}
+        self._top = {}
+        self.built_at = None
+
+    def clear(self):
+        with self._lock:
+            self._keys, self._entries = [], []
+            self._ranks, self._labels, self._top = {}, {}, {}
+            self.built_at = None
+
+    def load(self, items):
+        """Строит индекс заново из (вид, id, подпись, ранг)."""
+        pairs = []
+        ranks, labels = {}, {}
+        for kind, ident, label, rank in items:
+            entry = (kind, ident)
+            ranks[entry], labels[entry] = rank or 0, label
+            pairs.extend(
+                (key, entry) for key in label_keys(kind, ident, label))
+        pairs.sort()
+        keys = [key for key, _ in pairs]
+        entries = [entry for _, entry in pairs]
+        top = top_lists(keys, entries, ranks)
+        with self._lock:
+            self._keys, self._entries = keys, entries
+            self._ranks, self._labels, self._top = ranks, labels, top
+            self.built_at = time.monotonic()
+
+    def add(self, kind, ident, label, rank=0):
+        entry = (kind, ident)
+        with self._lock:
+            self._remove(entry)
+            self._ranks[entry], self._labels[entry] = rank, label
+            for key in label_keys(kind, ident, label):
+                position = bisect_right(self._keys, key)
+                self._keys.insert(position, key)
+                self._entries.insert(position, entry)
+                for prefix in self._top_prefixes(key):
+                    self._top[prefix] = rank_entries(
+                        self._top[prefix] + [entry], self._ranks)
+
+    def remove(self, kind, ident):
+        with self._lock:
+            self._remove((kind, ident))
+
+    def _remove(self, entry):
+        label = self._labels.pop(entry, None)
+        self._ranks.pop(entry, None)
+        if label is None:
+            return
+        for key in label_keys(*entry, label):
+            low = bisect_left(self._keys, key)
+            high = bisect_right(self._keys, key)
+            for position in range(high - 1, low - 1, -1):
+                if self._entries[position] == entry:
+                    del self._keys[position]
+                    del self._entries[position]
+            for prefix in self._top_prefixes(key):
+                if entry in self._top[prefix]:
+                    # Место удалённой записи занимает следующая по рангу.
+                    self._top[prefix] = rank_entries(
+                        self._matches(prefix), self._ranks)
+
+    def _top_prefixes(self, key):
+        """Префиксы ключа с готовыми списками, от коротких к длинным."""
+        for length in range(1, len(key) + 1):
+            # Префиксу короче частого подходит не меньше ключей, поэтому
+            # дальше первого редкого префикса частых нет.
+            if key[:length] not in self._top:
+                return
+            yield key[:length]
+
+    def _matches(self, prefix):
+        low = bisect_left(self._keys, prefix)
+        high = bisect_left(self._keys, prefix + '\uffff', low)
+        return self._entries[low:high]
+
+    def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Записи с ключом на prefix, от самых популярных."""
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        with self._lock:
+            top = self._top.get(prefix)
+            if top is not None and limit <= AUTOCOMPLETE_LIMIT:
+                ranked = top[:limit]
+            else:
+                ranked = rank_entries(
+                    self._matches(prefix), self._ranks, limit)
+            return [
+                (kind, ident, self._labels[(kind, ident)], self._ranks[
+                    (kind, ident)]) for kind, ident in ranked]
+
+
+def rank_entries(entries, ranks, limit=AUTOCOMPLETE_LIMIT):
+    """Первые limit разных записей от самых популярных."""
+    return heapq.nsmallest(
+        limit, set(entries), key=lambda entry: (-ranks[entry], entry))
+
+
+def top_lists(keys, entries, ranks):
+    """
+    Готовые списки лучших записей для префиксов, которым подходит больше
+    AUTOCOMPLETE_SCAN ключей. Частые префиксы длины n ищутся только
+    внутри частых префиксов длины n - 1, поэтому каждый уровень
+    просматривает ключи не больше одного раза.
+    """
+    top = {}
+    ranges = [(0, len(keys))]
+    length = 1
+    while ranges:
+        frequent = []
+        for low, high in ranges:
+            position = low
+            while position < high:
+                if len(keys[position]) < length:
+                    position += 1
+                    continue
+                prefix = keys[position][:length]
+                end = bisect_left(keys, prefix + '\uffff', position, high)
+                if end - position > AUTOCOMPLETE_SCAN:
+                    top[prefix] = rank_entries(entries[position:end], ranks)
+                    frequent.append((position, end))
+                position = end
+        ranges = frequent
+        length += 1
+    return top
+
+
+def label_keys(kind, ident, label):
+    """Ключи, по которым находится запись: имя или slug и название."""
+    keys = {ident, label} if kind == GROUP else {ident}
+    return {key.lower() for key in keys if key}
+
+
+def _indexed_items():
+    users = User.objects.values_list('username', 'stats__followers_count')
+    for username, followers_count in users.iterator():
+        yield USER, username, username, followers_count
+    groups = Group.objects.values_list('slug', 'title', 'posts_count')
+    for slug, title, posts_count in groups.iterator():
+        yield GROUP, slug, title, posts_count
+
+
+prefix_index = PrefixIndex()
+
+_build_lock = Lock()
+_refresh_lock = Lock()
+_refreshing = False
+
+
+def build_prefix_index():
+    """
+    Первое построение индекса. Параллельные запросы ждут одно общее
+    построение, а не отвечают по пустому индексу.
+    """
+    with _build_lock:
+        if prefix_index.built_at is None:
+            prefix_index.load(_indexed_items())
+
+
+def warm_prefix_index():
+    """Строит индекс при старте воркера; при ошибке его построит запрос."""
+    try:
+        build_prefix_index()
+    except Exception:
+        logger.exception('Autocomplete index warm-up failed')
+    finally:
+        connection.close()
+
+
+def refresh_prefix_index():
+    """Строит индекс заново; поиск до конца построения видит прежний."""
+    global _refreshing
+    try:
+        prefix_index.load(_indexed_items())
+    except Exception:
+        logger.exception('Autocomplete index rebuild failed')
+    finally:
+        connection.close()
+        with _refresh_lock:
+            _refreshing = False
+
+
+def get_prefix_index():
+    """
+    Индекс процесса. Первый раз он строится сразу, а раз в
+    AUTOCOMPLETE_REFRESH перестраивается в фоновом потоке, пока запросы
+    отвечают по прежнему индексу. С BACKGROUND_JOBS_EAGER индекс
+    перестраивается без потока.
+    """
+    built_at = prefix_index.built_at
+    if built_at is None:
+        build_prefix_index()
+        return prefix_index
+    if time.monotonic() - built_at <= settings.AUTOCOMPLETE_REFRESH:
+        return prefix_index
+    if settings.BACKGROUND_JOBS_EAGER:
+        prefix_index.load(_indexed_items())
+        return prefix_index
+    global _refreshing
+    with _refresh_lock:
+        if _refreshing:
+            return prefix_index
+        _refreshing = True
+    Thread(
+        target=refresh_prefix_index, name='autocomplete', daemon=True
+    ).start()
+    return prefix_index
+
+
+def index_user(user, followers_count=0):
+    if prefix_index.built_at is not None:
+        prefix_index.add(
+            USER, user.username, user.username, followers_count or 0)
+
+
+def index_group(group):
+    if prefix_index.built_at is not None:
+        prefix_index.add(GROUP, group.slug, group.title, group.posts_count)
+
+
+def unindex(kind, ident):
+    if prefix_index.built_at is not None:
+        prefix_index.remove(kind, ident)
@@ -0,0 +1,125 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+
+from core.cache import get_or_recompute
+
+
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+
+INDEX_GENERATION = 'index'
+
+
+def group_generation(slug):
+    return f'group:{slug}'
+
+
+def profile_generation(username):
+    return f'profile:{username}'
+
+
+def post_generation(post_id):
+    return f'post:{post_id}'
+
+
+def author_card_generation(user_id):
+    return f'card:author:{user_id}'
+
+
+def group_card_generation(group_id):
+    return f'card:group:{group_id}'
+
+
+def card_generations(post):
+    """Области кэша, от которых зависит карточка поста, кроме него самого."""
+    scopes = [author_card_generation(post.author_id)]
+    if post.group_id:
+        scopes.append(group_card_generation(post.group_id))
+    return scopes
+
+
+def post_generations(post):
+    scopes = [
+        INDEX_GENERATION,
+        profile_generation(post.author.username),
+        post_generation(post.pk),
+    ]
+    if post.group_id:
+        scopes.append(group_generation(post.group.slug))
+    return scopes
+
+
+def generation_key(scope):
+    return f'generation:{scope}'
+
+
+def _now_generation():
+    return int(time.time() * 1000)
+
+
+def get_generations(*scopes):
+    """
+    Текущие поколения областей кэша. Поколение - это отметка времени в
+    миллисекундах, поэтому после вытеснения ключа из кэша оно не может
+    совпасть со старым и вернуть устаревшие страницы.
+    """
+    keys = [generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        generation = _now_generation()
+        for key in missing:
+            cache.add(key, generation, None)
+        found.update(cache.get_many(missing))
+    return [found.get(key, 0) for key in keys]
+
+
+def bump_generations(*scopes):
+    for scope in scopes:
+        key = generation_key(scope)
+        current = cache.get(key) or 0
+        cache.set(key, max(_now_generation(), current + 1), None)
+
+
+def page_cache_key(request, generations):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'page:{}:u{}:g{}'.format(
+        path, request.user.pk or 0,
+        '-'.join(str(generation) for generation in generations))
+
+
+def cache_by_generation(timeout, *scope_templates):
+    """
+    Кэш страниц, ключ которого включает поколения областей кэша и id
+    пользователя. Шаблоны областей заполняются аргументами из URL, а
+    изменение данных сбрасывает страницы сменой поколения, не дожидаясь
+    истечения timeout.
+
+    Страница пересчитывается через get_or_recompute: после смены поколения
+    её рендерит один запрос, а не все пришедшие одновременно. Кэшируются
+    только успешные ответы без cookies.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            scopes = [
+                template.format(**kwargs) for template in scope_templates]
+            key = page_cache_key(request, get_generations(*scopes))
+            rendered = []
+
+            def compute():
+                response = view(request, *args, **kwargs)
+                rendered.append(response)
+                if (response.status_code != 200 or response.streaming
+                        or response.cookies):
+                    return None
+                return response
+
+            response = get_or_recompute(key, compute, timeout)
+            return rendered[0] if rendered else response
+        return wrapper
+    return decorator
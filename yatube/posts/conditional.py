@@ -0,0 +1,118 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+from .caching import (
+    INDEX_GENERATION, author_card_generation, get_generations,
+    group_card_generation, group_generation, post_generation,
+    profile_generation)
+from .counts import INDEX_SCOPE, get_count
+from .models import Group, Post, UserStats
+
+
+def _from_generation(generation):
+    return datetime.fromtimestamp(generation / 1000, tz=timezone.utc)
+
+
+def make_etag(request, *parts):
+    """ETag страницы: путь с параметрами, пользователь и состояние данных."""
+    source = '|'.join(
+        [request.get_full_path(), str(request.user.pk or 0)]
+        + [str(part) for part in parts])
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def index_validators(request):
+    generation, = get_generations(INDEX_GENERATION)
+    count = get_count(INDEX_SCOPE, Post.objects.all())
+    return (
+        make_etag(request, generation, count), _from_generation(generation))
+
+
+def group_validators(request, slug):
+    count = Group.objects.filter(slug=slug).values_list(
+        'posts_count', flat=True).first()
+    if count is None:
+        return None
+    generation, = get_generations(group_generation(slug))
+    return (
+        make_etag(request, generation, count), _from_generation(generation))
+
+
+def profile_validators(request, username):
+    stats = UserStats.objects.filter(user__username=username).values_list(
+        'posts_count', 'followers_count', 'following_count').first()
+    if stats is None:
+        return None
+    generation, = get_generations(profile_generation(username))
+    return (
+        make_etag(request, generation, *stats), _from_generation(generation))
+
+
+def post_validators(request, post_id):
+    post = Post.objects.filter(pk=post_id).values_list(
+        'modified', 'comments_count', 'author__stats__posts_count',
+        'author_id', 'group_id').first()
+    if post is None:
+        return None
+    modified, comments_count, posts_count, author_id, group_id = post
+    # Имя автора и адрес группы меняются без правки поста.
+    scopes = [post_generation(post_id), author_card_generation(author_id)]
+    if group_id:
+        scopes.append(group_card_generation(group_id))
+    generations = get_generations(*scopes)
+    last_modified = max(
+        modified, *(_from_generation(generation)
+                    for generation in generations))
+    return (
+        make_etag(
+            request, *generations, modified.timestamp(), comments_count,
+            posts_count),
+        last_modified)
+
+
+def conditional_page(validators):
+    """
+    Условный GET для страниц с постами. Валидаторы считаются по
+    поколениям кэша и счётчикам без рендеринга страницы; при совпадении
+    If-None-Match или If-Modified-Since сразу возвращается 304.
+
+    Анонимные страницы одинаковы для всех и могут храниться в общих
+    кэшах, страницы пользователей - только в браузере. И те и другие
+    перепроверяются при каждом запросе.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            found = None
+            if request.method in ('GET', 'HEAD'):
+                found = validators(request, *args, **kwargs)
+            if found is None:
+                return view(request, *args, **kwargs)
+            etag, last_modified = found
+            etag = quote_etag(etag)
+            last_modified = int(last_modified.timestamp())
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                _patch_page_cache_control(request, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def _patch_page_cache_control(request, response):
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(
+            response, public=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ('Cookie',))
@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Group, Post, UserStats
+
+
+COUNT_CACHE_TIMEOUT = 60 * 60 * 24
+ESTIMATE_THRESHOLD = 10 ** 6
+
+INDEX_SCOPE = 'index'
+
+
+def count_key(scope):
+    return f'count:{scope}'
+
+
+def estimate_count(model):
+    """
+    Оценка числа строк таблицы без полного прохода по ней: статистика
+    планировщика в PostgreSQL и MAX(rowid) в SQLite.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [model._meta.db_table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(rowid) FROM {table}')
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_count(scope, queryset):
+    key = count_key(scope)
+    count = cache.get(key)
+    if count is not None:
+        return count
+    if scope == INDEX_SCOPE:
+        estimate = estimate_count(queryset.model)
+        if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+            count = estimate
+    if count is None:
+        count = queryset.count()
+    cache.add(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def adjust_counts(scopes, delta):
+    for scope in scopes:
+        try:
+            cache.incr(count_key(scope), delta)
+        except ValueError:
+            # Счётчика нет в кэше: он будет посчитан при следующем чтении.
+            pass
+
+
+def bump(queryset, delta, *fields):
+    """Атомарно меняет счётчики на delta, не опуская их ниже нуля."""
+    return queryset.update(**{
+        field: Greatest(F(field) + delta, 0) for field in fields})
+
+
+def bump_user(user_id, delta, *fields):
+    stats = UserStats.objects.filter(user_id=user_id)
+    if bump(stats, delta, *fields) or delta < 0:
+        # Уменьшать отсутствующие счётчики незачем: строки нет и тогда,
+        # когда пользователь удаляется каскадом вместе с ней.
+        return
+    UserStats.objects.get_or_create(user_id=user_id)
+    bump(stats, delta, *fields)
+
+
+def bump_group(group_id, delta):
+    if group_id:
+        bump(Group.objects.filter(pk=group_id), delta, 'posts_count')
+
+
+def bump_post(post_id, delta):
+    bump(Post.objects.filter(pk=post_id), delta, 'comments_count')
+
+
+def get_user_stats(user):
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return UserStats(user=user)
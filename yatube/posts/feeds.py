@@ -0,0 +1,394 @@
+import heapq
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page
+from django.db import connection
+from django.db.models import F, Q, Window
+from django.db.models.expressions import OrderBy
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .jobs import defer
+from .models import Follow, Post, PulledAuthor, TimelineEntry, UserStats
+from .utils import (
+    LIST_RELATED, POSTS_LIMIT, KeysetPaginator, decode_cursor,
+    encode_cursor)
+
+
+TIMELINE_LENGTH = 1000
+TIMELINE_TRIM_EVERY = 50
+FAN_OUT_BATCH = 1000
+
+AUTHOR_LIST_LENGTH = 200
+AUTHOR_LIST_TIMEOUT = 60 * 60 * 24
+# Больше стольких авторов лента подписок не собирает слиянием их списков.
+MERGE_AUTHORS_LIMIT = 200
+
+DEMOTE_TIMEOUT = 60 * 60
+
+
+def _numbered(queryset, partition, *order):
+    """
+    SQL и параметры запроса, который нумерует строки queryset от 1 в
+    порядке order внутри каждого значения partition (столбец position).
+    """
+    numbered = queryset.annotate(position=Window(
+        RowNumber(), partition_by=[F(partition)], order_by=list(order)))
+    return numbered.order_by().query.sql_with_params()
+
+
+def trim_timelines(user_ids):
+    """
+    Обрезает ленты подписчиков до TIMELINE_LENGTH последних записей
+    одним запросом для всех лент.
+    """
+    sql, params = _numbered(
+        TimelineEntry.objects.filter(user_id__in=user_ids).values('pk'),
+        'user_id', F('created').desc(), F('post_id').desc())
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN '
+            f'(SELECT id FROM ({sql}) WHERE position > %s)',
+            (*params, TIMELINE_LENGTH))
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if PulledAuthor.objects.filter(author_id=post.author_id).exists():
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(user_id)
+        if len(batch) >= FAN_OUT_BATCH:
+            _push(post, batch)
+            batch = []
+    if batch:
+        _push(post, batch)
+
+
+def _push(post, user_ids):
+    _fill(user_ids, [(post.pk, post.created)])
+
+
+def _fill(user_ids, posts):
+    """Добавляет посты [(id, created)] в ленты подписчиков user_ids."""
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post_id=pk, created=created)
+            for user_id in user_ids
+            for pk, created in posts
+        ],
+        ignore_conflicts=True,
+    )
+    # Один пост удлиняет ленты на одну запись, поэтому обрезаются они в
+    # среднем раз в TIMELINE_TRIM_EVERY постов: лишние записи старше
+    # TIMELINE_LENGTH лишь ненадолго занимают место.
+    if len(posts) > 1 or random.randrange(TIMELINE_TRIM_EVERY) == 0:
+        trim_timelines(user_ids)
+
+
+def _latest_posts(author_id, since=None):
+    posts = Post.objects.filter(author_id=author_id)
+    if since is not None:
+        posts = posts.filter(created__gte=since)
+    return list(posts.values_list('pk', 'created')[:TIMELINE_LENGTH])
+
+
+def backfill_timeline(user_id, author_id):
+    if PulledAuthor.objects.filter(author_id=author_id).exists():
+        return
+    _fill([user_id], _latest_posts(author_id))
+
+
+def prune_timeline(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def demote_lock_key(author_id):
+    return f'feed_demote:{author_id}'
+
+
+def _followers_count(author_id):
+    return UserStats.objects.filter(user_id=author_id).values_list(
+        'followers_count', flat=True).first() or 0
+
+
+def classify_author(author_id):
+    """
+    Пересчитывает режим автора после подписки или отписки. Популярные
+    авторы переводятся на чтение при показе ленты, а при падении ниже
+    порога их посты возвращаются в ленты подписчиков фоновой задачей.
+    """
+    followers_count = _followers_count(author_id)
+    threshold = settings.FEED_PULL_THRESHOLD
+    pulled = PulledAuthor.objects.filter(author_id=author_id)
+
+    if followers_count >= threshold:
+        if not pulled.exists():
+            PulledAuthor.objects.get_or_create(author_id=author_id)
+        return
+    if (followers_count < threshold * settings.FEED_PULL_HYSTERESIS
+            and pulled.exists()
+            and cache.add(demote_lock_key(author_id), True, DEMOTE_TIMEOUT)):
+        defer(demote_author, author_id)
+
+
+def demote_author(author_id):
+    """
+    Раскладывает посты автора, опустившегося ниже порога, по лентам
+    подписчиков. Пока ленты заполняются, автор остаётся популярным и его
+    посты читаются при показе ленты, а посты, опубликованные за это
+    время, раскладываются после снятия отметки.
+    """
+    try:
+        threshold = settings.FEED_PULL_THRESHOLD
+        if _followers_count(author_id) >= (
+                threshold * settings.FEED_PULL_HYSTERESIS):
+            return
+        started = timezone.now()
+        _fill_followers(author_id, _latest_posts(author_id))
+        if PulledAuthor.objects.filter(author_id=author_id).delete()[0]:
+            _fill_followers(author_id, _latest_posts(author_id, started))
+    finally:
+        cache.delete(demote_lock_key(author_id))
+
+
+def _fill_followers(author_id, posts):
+    if not posts:
+        return
+    followers = Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(user_id)
+        if len(batch) >= FAN_OUT_BATCH:
+            _fill(batch, posts)
+            batch = []
+    if batch:
+        _fill(batch, posts)
+
+
+def _after(cursor, forward, created='created', pk='pk'):
+    """Условие «после курсора» по ключу (created, id) в сторону чтения."""
+    if forward:
+        return (Q(**{f'{created}__lt': cursor[0]})
+                | Q(**{created: cursor[0], f'{pk}__lt': cursor[1]}))
+    return (Q(**{f'{created}__gt': cursor[0]})
+            | Q(**{created: cursor[0], f'{pk}__gt': cursor[1]}))
+
+
+class TimelinePaginator(KeysetPaginator):
+    """
+    Лента подписок: срез материализованной ленты, слитый с последними
+    постами популярных авторов. У каждого популярного автора читается не
+    больше страницы постов по индексу (автор, дата), все авторы - одним
+    запросом, поэтому стоимость страницы не зависит ни от числа их
+    постов, ни от числа самих авторов.
+    """
+
+    def __init__(self, user, per_page):
+        super().__init__(Post.objects.none(), per_page)
+        self.user = user
+
+    def keyset_page(self, after=None, before=None):
+        if after or before:
+            return super().keyset_page(after=after, before=before)
+        # Первая страница - обычная Page, как у остальных лент. Числа
+        # постов в ленте никто не считает: лишней записи хватает, чтобы
+        # num_pages знал о следующей странице.
+        rows = self.fetch(None, True, self.per_page + 1)
+        self.count = len(rows)
+        page_obj = Page(rows[:self.per_page], 1, self)
+        page_obj.next_cursor = encode_cursor(rows[self.per_page - 1]) if (
+            page_obj.has_next()) else None
+        page_obj.previous_cursor = None
+        return page_obj
+
+    def fetch(self, cursor, forward, limit):
+        order = '-' if forward else ''
+        condition = Q(timeline_entries__user=self.user)
+        if cursor:
+            condition &= _after(
+                cursor, forward, 'timeline_entries__created',
+                'timeline_entries__post')
+        streams = [
+            list(Post.objects.select_related(*LIST_RELATED).filter(
+                condition).order_by(
+                    f'{order}timeline_entries__created',
+                    f'{order}timeline_entries__post')[:limit]),
+            self.fetch_pulled(cursor, forward, limit),
+        ]
+        posts = []
+        for post in heapq.merge(
+                *streams, key=lambda post: (post.created, post.pk),
+                reverse=forward):
+            # Посты, попавшие в ленту до того, как автор стал популярным,
+            # приходят и из ленты, и из его последних постов.
+            if posts and posts[-1].pk == post.pk:
+                continue
+            posts.append(post)
+            if len(posts) == limit:
+                break
+        return posts if forward else posts[::-1]
+
+    def fetch_pulled(self, cursor, forward, limit):
+        """
+        Следующие limit постов каждого популярного автора из подписок
+        одним запросом: лишние посты отбрасываются в самой базе.
+        """
+        pulled = Follow.objects.filter(
+            user=self.user, author__pulled_feed__isnull=False).values(
+                'author_id')
+        posts = Post.objects.filter(author_id__in=pulled)
+        if cursor:
+            posts = posts.filter(_after(cursor, forward))
+        order = '-' if forward else ''
+        sql, params = _numbered(
+            posts.values('pk'), 'author_id',
+            *(OrderBy(F(field), descending=forward)
+              for field in ('created', 'pk')))
+        pk_column = f'{Post._meta.db_table}.{Post._meta.pk.column}'
+        return list(Post.objects.select_related(*LIST_RELATED).extra(
+            where=[f'{pk_column} IN (SELECT id FROM ({sql}) '
+                   f'WHERE position <= %s)'],
+            params=(*params, limit)).order_by(
+                f'{order}created', f'{order}pk'))
+
+
+def get_feed_page(user, request):
+    paginator = TimelinePaginator(user, POSTS_LIMIT)
+    return paginator.keyset_page(
+        after=decode_cursor(request.GET.get('after')),
+        before=decode_cursor(request.GET.get('before')))
+
+
+def author_posts_key(author_id):
+    return f'author_posts:{author_id}'
+
+
+def _older_posts(author_id, key, limit):
+    queryset = Post.objects.filter(author_id=author_id)
+    if key:
+        created, pk = key
+        queryset = queryset.filter(
+            Q(created__lt=created) | Q(created=created, pk__lt=pk))
+    return list(queryset.values_list('created', 'pk')[:limit])
+
+
+def _newer_posts(author_id, key, limit):
+    created, pk = key
+    queryset = Post.objects.filter(author_id=author_id).filter(
+        Q(created__gt=created) | Q(created=created, pk__gt=pk))
+    return list(queryset.order_by('created', 'pk').values_list(
+        'created', 'pk')[:limit])
+
+
+def _split_index(entries, key):
+    """Индекс первой записи старше key в списке, упорядоченном от новых."""
+    low, high = 0, len(entries)
+    while low < high:
+        middle = (low + high) // 2
+        if entries[middle] < key:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def _latest_posts_by_author(author_ids):
+    """
+    Списки (created, id) последних AUTHOR_LIST_LENGTH постов каждого
+    автора одним запросом: лишние посты отбрасываются в самой базе.
+    """
+    sql, params = _numbered(
+        Post.objects.filter(author_id__in=author_ids).values(
+            'pk', 'author_id', 'created'),
+        'author_id', F('created').desc(), F('pk').desc())
+    lists = {author_id: [] for author_id in author_ids}
+    for post in Post.objects.raw(
+            f'SELECT * FROM ({sql}) WHERE position <= %s '
+            f'ORDER BY author_id, position',
+            (*params, AUTHOR_LIST_LENGTH)):
+        lists[post.author_id].append((post.created, post.pk))
+    return lists
+
+
+def get_author_lists(author_ids):
+    """Списки (created, id) последних постов авторов, от новых к старым."""
+    keys = {author_posts_key(author_id): author_id for author_id in author_ids}
+    lists = {
+        keys[key]: entries for key, entries in cache.get_many(keys).items()}
+    missing = [
+        author_id for author_id in author_ids if author_id not in lists]
+    if missing:
+        fetched = _latest_posts_by_author(missing)
+        cache.set_many({
+            author_posts_key(author_id): entries
+            for author_id, entries in fetched.items()}, AUTHOR_LIST_TIMEOUT)
+        lists.update(fetched)
+    return lists
+
+
+def forget_author_list(author_id):
+    cache.delete(author_posts_key(author_id))
+
+
+class MergeFeedPaginator(KeysetPaginator):
+    """
+    Лента подписок, собранная слиянием кэшированных списков постов
+    каждого автора. Курсор задаёт позицию сразу во всех списках, поэтому
+    следующая страница продолжает слияние, а не начинает его заново.
+    """
+
+    def __init__(self, author_ids, per_page):
+        super().__init__(Post.objects.none(), per_page)
+        self.author_ids = author_ids
+
+    def fetch(self, cursor, forward, limit):
+        streams = []
+        for author_id, entries in get_author_lists(self.author_ids).items():
+            split = _split_index(entries, cursor) if cursor else 0
+            if not forward:
+                if split and entries[split - 1] == cursor:
+                    split -= 1
+                if (split == len(entries)
+                        and len(entries) >= AUTHOR_LIST_LENGTH):
+                    streams.append(_newer_posts(author_id, cursor, limit))
+                else:
+                    streams.append(
+                        entries[max(split - limit, 0):split][::-1])
+                continue
+            stream = entries[split:split + limit]
+            if len(stream) < limit and len(entries) >= AUTHOR_LIST_LENGTH:
+                # Курсор ушёл за конец кэшированного списка: дочитываем
+                # более старые посты автора из базы.
+                last = stream[-1] if stream else cursor
+                stream += _older_posts(author_id, last, limit - len(stream))
+            streams.append(stream)
+        if forward:
+            merged = list(heapq.merge(*streams, reverse=True))[:limit]
+        else:
+            merged = list(heapq.merge(*streams))[:limit][::-1]
+        posts = Post.objects.select_related(*LIST_RELATED).in_bulk(
+            [pk for _, pk in merged])
+        return [posts[pk] for _, pk in merged if pk in posts]
+
+
+def get_merged_feed_page(user, request):
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+    author_ids = list(Follow.objects.filter(
+        user=user).values_list('author_id', flat=True)[
+            :MERGE_AUTHORS_LIMIT + 1])
+    if len(author_ids) > MERGE_AUTHORS_LIMIT:
+        # Слияние стольких списков на каждой странице дороже чтения
+        # материализованной ленты, а курсоры у лент одинаковые.
+        return get_feed_page(user, request)
+    paginator = MergeFeedPaginator(author_ids, POSTS_LIMIT)
+    return paginator.keyset_page(after=after, before=before)
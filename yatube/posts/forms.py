@@ -1,5 +1,8 @@
 from django import forms
+from django.core.exceptions import ValidationError
+
 from .models import Post, Comment
+from .uploads import ImageRejected, check_image
 
 
 class PostForm(forms.ModelForm):
@@ -7,6 +10,25 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Файлы, отклонённые LimitedUploadHandler, не доходят до формы:
+        # вместо них она показывает ошибку загрузки.
+        self.upload_errors = upload_errors or {}
+
+    def clean_image(self):
+        if 'image' in self.upload_errors:
+            raise ValidationError(
+                self.upload_errors['image'], code='invalid_image')
+        image = self.cleaned_data['image']
+        opened = getattr(image, 'image', None)
+        if opened is not None:
+            try:
+                check_image(opened)
+            except ImageRejected as error:
+                raise ValidationError(str(error), code='invalid_image')
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,53 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = Lock()
+
+
+def get_executor(pool='jobs', workers=None):
+    """
+    Пул потоков pool, один на процесс. Создаётся при первой задаче с
+    workers потоками, по умолчанию BACKGROUND_WORKERS.
+    """
+    with _executors_lock:
+        if pool not in _executors:
+            _executors[pool] = ThreadPoolExecutor(
+                max_workers=workers or settings.BACKGROUND_WORKERS,
+                thread_name_prefix=pool)
+        return _executors[pool]
+
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background job %s%r failed', func.__name__, args)
+    finally:
+        connection.close()
+
+
+def defer(func, *args, pool='jobs', workers=None):
+    """
+    Выполняет func(*args) в фоновом потоке после коммита текущей
+    транзакции: в общем пуле или в отдельном пуле pool на workers
+    потоков (get_executor). При BACKGROUND_JOBS_EAGER задача выполняется
+    сразу после коммита в том же потоке: так её видят тесты с базой в
+    памяти.
+    """
+    def submit():
+        if settings.BACKGROUND_JOBS_EAGER:
+            try:
+                func(*args)
+            except Exception:
+                logger.exception(
+                    'Background job %s%r failed', func.__name__, args)
+            return
+        get_executor(pool, workers).submit(_run, func, args)
+    transaction.on_commit(submit)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import Post
+from posts.thumbnails import generate_post_thumbnails
+
+# Приоритет процессов пула ниже, чем у веб-воркеров на той же машине.
+WORKER_NICENESS = 10
+
+
+def settings_fingerprint():
+    """Отпечаток настроек миниатюр: при их смене обход начинается заново."""
+    return hashlib.md5(repr((
+        settings.POST_THUMBNAIL_SIZES, settings.POST_IMAGE_WIDTHS,
+        settings.POST_IMAGE_FORMATS)).encode()).hexdigest()
+
+
+def init_worker():
+    if not apps.ready:
+        # Процесс запущен через spawn, а не fork.
+        django.setup()
+    connections.close_all()
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+
+
+def backfill_post(post_id):
+    """Миниатюры одного поста; возвращает текст ошибки или None."""
+    try:
+        generate_post_thumbnails(post_id)
+    except Exception as error:
+        return f'{type(error).__name__}: {error}'
+    return None
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_checkpoint(path, state):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as checkpoint:
+        json.dump(state, checkpoint)
+    os.replace(temp_path, path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт миниатюры и адаптивные варианты картинок всех постов '
+        'в пуле процессов, продолжая с места остановки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов; 0 - без пула, в текущем процессе')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, 'thumbnail_backfill.json'),
+            help='Файл с id последнего обработанного поста')
+        parser.add_argument(
+            '--throttle', type=float, default=0,
+            help='Пауза в секундах после каждой пачки постов')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать сначала, не глядя на checkpoint')
+
+    def handle(self, *args, workers, batch_size, checkpoint, throttle,
+               restart, **options):
+        state = self.load_state(checkpoint, restart)
+        executor = None
+        if workers:
+            # Дочерние процессы не должны унаследовать открытое соединение.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker)
+        try:
+            while True:
+                ids = list(
+                    Post.objects.exclude(image='').filter(
+                        pk__gt=state['last_pk']).order_by('pk')
+                    .values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    break
+                self.process_batch(executor, ids, state)
+                # Пачка обработана целиком, поэтому после остановки её
+                # не придётся повторять.
+                write_checkpoint(checkpoint, state)
+                if throttle:
+                    time.sleep(throttle)
+        finally:
+            if executor:
+                executor.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры созданы: {state["done"]}, ошибок {state["failed"]}'))
+
+    def load_state(self, checkpoint, restart):
+        fingerprint = settings_fingerprint()
+        state = None if restart else read_checkpoint(checkpoint)
+        if state and state.get('settings') == fingerprint:
+            if state['last_pk']:
+                self.stdout.write(
+                    f'Продолжение после поста {state["last_pk"]}')
+            return state
+        return {'settings': fingerprint, 'last_pk': 0, 'done': 0, 'failed': 0}
+
+    def process_batch(self, executor, ids, state):
+        if executor:
+            errors = executor.map(backfill_post, ids)
+        else:
+            errors = map(backfill_post, ids)
+        for post_id, error in zip(ids, errors):
+            if error:
+                state['failed'] += 1
+                self.stderr.write(f'Пост {post_id}: {error}')
+            else:
+                state['done'] += 1
+        state['last_pk'] = ids[-1]
+        self.stdout.write(
+            f'Готово {state["done"]}, ошибок {state["failed"]}, '
+            f'последний пост {state["last_pk"]}')
@@ -0,0 +1,111 @@
+import math
+import os
+import statistics
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import ImageChops, ImageStat
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
+from sorl.thumbnail.parsers import parse_geometry
+
+from posts.thumbnail_engine import Engine
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+def collect_images(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def render(engine, data, geometry_string, options):
+    image = engine.get_image(BytesIO(data))
+    geometry = parse_geometry(
+        geometry_string, engine.get_image_ratio(image, options))
+    thumbnail = engine.create(image, geometry, options)
+    raw = engine._get_raw_data(
+        thumbnail, options['format'], options['quality'],
+        engine.get_image_info(image), options['progressive'])
+    return thumbnail, raw
+
+
+def psnr(first, second):
+    """PSNR второй картинки относительно первой в дБ (больше - ближе)."""
+    if first.size != second.size:
+        return None
+    difference = ImageChops.difference(
+        first.convert('RGB'), second.convert('RGB'))
+    mse = statistics.mean(
+        rms ** 2 for rms in ImageStat.Stat(difference).rms)
+    return math.inf if not mse else 10 * math.log10(255 ** 2 / mse)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает скорость и качество миниатюр движка posts с '
+        'движком PIL из sorl-thumbnail на наборе картинок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Картинки или каталоги с ними (по умолчанию - картинки '
+                 'постов в MEDIA_ROOT)')
+        parser.add_argument(
+            '--size', default='card',
+            help='Размер из POST_THUMBNAIL_SIZES')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, paths, size, repeat, **options):
+        if size not in settings.POST_THUMBNAIL_SIZES:
+            raise CommandError(f'Неизвестный размер миниатюры: {size}')
+        geometry, size_options = settings.POST_THUMBNAIL_SIZES[size]
+        thumbnail_options = dict(
+            ThumbnailBackend.default_options, format='JPEG', **size_options)
+        for key, attr in ThumbnailBackend.extra_options:
+            thumbnail_options.setdefault(
+                key, getattr(thumbnail_settings, attr))
+        files = list(collect_images(
+            paths or [os.path.join(settings.MEDIA_ROOT, 'posts')]))
+        if not files:
+            raise CommandError('Картинки не найдены')
+
+        engines = (('pil', PILEngine()), ('posts', Engine()))
+        totals = {name: [] for name, _ in engines}
+        for path in files:
+            with open(path, 'rb') as source:
+                data = source.read()
+            results = {}
+            for name, engine in engines:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    thumbnail, _ = render(
+                        engine, data, geometry, thumbnail_options)
+                    timings.append(time.perf_counter() - started)
+                results[name] = (statistics.median(timings), thumbnail)
+                totals[name].append(results[name][0])
+            (pil_time, expected), (fast_time, actual) = (
+                results['pil'], results['posts'])
+            quality = psnr(expected, actual)
+            self.stdout.write(
+                '{}: pil {:.1f} мс, posts {:.1f} мс, ускорение {:.1f}x, '
+                'PSNR {}'.format(
+                    os.path.basename(path), pil_time * 1000,
+                    fast_time * 1000, pil_time / fast_time,
+                    '-' if quality is None else f'{quality:.1f} дБ'))
+
+        pil_total, fast_total = sum(totals['pil']), sum(totals['posts'])
+        self.stdout.write(
+            f'Всего {len(files)} картинок: pil {pil_total * 1000:.1f} мс, '
+            f'posts {fast_total * 1000:.1f} мс, '
+            f'ускорение {pil_total / fast_total:.1f}x')
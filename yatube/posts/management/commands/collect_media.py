@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default, delete as delete_with_thumbnails
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post, StoredImage
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def walk_files(storage, directory):
+    """
+    Имена файлов каталога хранилища (относительно его корня) и время их
+    изменения. Каталоги читаются по одному, поэтому в памяти никогда не
+    бывает всего списка файлов.
+    """
+    root = storage.path(directory)
+    for path, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            full_path = os.path.join(path, filename)
+            try:
+                mtime = os.stat(full_path).st_mtime
+            except FileNotFoundError:
+                continue
+            name = os.path.relpath(full_path, storage.location)
+            yield name.replace(os.sep, '/'), mtime
+
+
+class NameSet:
+    """
+    Множество имён во временной базе SQLite: строится потоком и не
+    держит все имена в памяти.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = sqlite3.connect(os.path.join(self.directory, 'names.db'))
+        self.db.execute(
+            'CREATE TABLE names (name TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def update(self, names):
+        self.db.executemany(
+            'INSERT OR IGNORE INTO names VALUES (?)',
+            ((name,) for name in names))
+
+    def found(self, names):
+        placeholders = ', '.join('?' * len(names))
+        return {row[0] for row in self.db.execute(
+            f'SELECT name FROM names WHERE name IN ({placeholders})',
+            names)}
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def kv_entries(identity, batch_size):
+    """Пачки пар (ключ, значение) хранилища sorl одного типа по ключу."""
+    prefix = add_prefix('', identity)
+    last_key = ''
+    while True:
+        rows = list(KVStore.objects.filter(
+            key__startswith=prefix, key__gt=last_key).order_by(
+                'key').values_list('key', 'value')[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Находит и удаляет картинки постов и миниатюры, на которые нет '
+        'ссылок, и устаревшие записи sorl-thumbnail')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: их пост '
+                 'может быть ещё не сохранён')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено')
+
+    def handle(self, *args, batch_size, min_age, dry_run, verbosity,
+               **options):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.verbosity = verbosity
+        self.cutoff = time.time() - min_age
+        self.storage = Post._meta.get_field('image').storage
+        action = 'Найдено' if dry_run else 'Удалено'
+
+        stale = self.collect_kvstore()
+        self.stdout.write(f'{action} устаревших записей sorl: {stale}')
+        originals = self.collect_originals()
+        self.stdout.write(f'{action} картинок без постов: {originals}')
+        thumbnails = self.collect_thumbnails()
+        self.stdout.write(f'{action} миниатюр без ссылок: {thumbnails}')
+
+    def report(self, name):
+        if self.verbosity > 1:
+            self.stdout.write(name)
+
+    def collect_kvstore(self):
+        """
+        Записи sorl об исходниках, которые больше не нужны постам, и о
+        миниатюрах, чьих файлов нет, вместе со списками миниатюр.
+        """
+        stale = 0
+        for rows in kv_entries('image', self.batch_size):
+            keys = self.stale_image_keys(rows)
+            if keys:
+                stale += KVStore.objects.filter(key__in=keys).count()
+            if keys and not self.dry_run:
+                default.kvstore._delete_raw(*keys)
+
+        for rows in kv_entries('thumbnails', self.batch_size):
+            image_keys = {
+                add_prefix(del_prefix(key)): key for key, _ in rows}
+            found = set(KVStore.objects.filter(
+                key__in=image_keys).values_list('key', flat=True))
+            keys = [
+                key for image_key, key in image_keys.items()
+                if image_key not in found]
+            stale += len(keys)
+            if keys and not self.dry_run:
+                default.kvstore._delete_raw(*keys)
+        return stale
+
+    def stale_image_keys(self, rows):
+        """
+        Ключи устаревших записей из пачки: сами записи, списки миниатюр
+        исходников и записи этих миниатюр. Без записи миниатюра станет
+        мусором и её файл удалит collect_thumbnails.
+        """
+        images = {
+            key: deserialize_image_file(value) for key, value in rows}
+        sources = {
+            image.name for image in images.values()
+            if not image.name.startswith(
+                thumbnail_settings.THUMBNAIL_PREFIX)}
+        used = set(StoredImage.objects.filter(
+            name__in=sources).values_list('name', flat=True))
+        keys = []
+        for key, image in images.items():
+            if image.name in sources:
+                alive = image.name in used
+            else:
+                alive = image.exists()
+            if not alive:
+                keys += [key, add_prefix(del_prefix(key), 'thumbnails')]
+                self.report(key)
+        thumbnail_lists = KVStore.objects.filter(
+            key__in=keys).values_list('value', flat=True)
+        for value in thumbnail_lists:
+            keys += [add_prefix(key) for key in deserialize(value)]
+        return keys
+
+    def collect_originals(self):
+        directory = Post._meta.get_field('image').upload_to
+        collected = 0
+        for batch in batched(
+                walk_files(self.storage, directory), self.batch_size):
+            names = [name for name, mtime in batch if mtime < self.cutoff]
+            used = set(StoredImage.objects.filter(
+                name__in=names).values_list('name', flat=True))
+            used.update(Post.objects.filter(
+                image__in=names).values_list('image', flat=True))
+            for name in names:
+                if name in used:
+                    continue
+                collected += 1
+                self.report(name)
+                if not self.dry_run:
+                    delete_with_thumbnails(ImageFile(name, self.storage))
+        return collected
+
+    def collect_thumbnails(self):
+        """
+        Миниатюры, о которых не знает sorl и которых нет в вариантах
+        постов. Имена из вариантов сначала выписываются во временное
+        множество на диске.
+        """
+        variants = NameSet()
+        try:
+            posts = Post.objects.exclude(image_variants='')
+            last_pk = 0
+            while True:
+                page = list(posts.filter(pk__gt=last_pk).order_by(
+                    'pk').values_list('pk', 'image_variants')[
+                        :self.batch_size])
+                if not page:
+                    break
+                last_pk = page[-1][0]
+                variants.update(
+                    name for _, value in page
+                    for entries in json.loads(value).values()
+                    for _, _, name in entries)
+            return self.collect_unknown_thumbnails(variants)
+        finally:
+            variants.close()
+
+    def collect_unknown_thumbnails(self, variants):
+        storage = default.storage
+        collected = 0
+        for batch in batched(
+                walk_files(storage, thumbnail_settings.THUMBNAIL_PREFIX),
+                self.batch_size):
+            names = [name for name, mtime in batch if mtime < self.cutoff]
+            if not names:
+                continue
+            keys = {
+                add_prefix(ImageFile(name, storage).key): name
+                for name in names}
+            used = variants.found(names)
+            used.update(keys[key] for key in KVStore.objects.filter(
+                key__in=keys).values_list('key', flat=True))
+            for name in names:
+                if name in used:
+                    continue
+                collected += 1
+                self.report(name)
+                if not self.dry_run:
+                    storage.delete(name)
+        return collected
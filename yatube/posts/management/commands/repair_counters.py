@@ -0,0 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+# Модель со счётчиками -> {поле счётчика: (модель-источник, внешний ключ)}.
+COUNTERS = (
+    (UserStats, 'user_id', {
+        'posts_count': (Post, 'author_id'),
+        'followers_count': (Follow, 'author_id'),
+        'following_count': (Follow, 'user_id'),
+    }),
+    (Group, 'pk', {
+        'posts_count': (Post, 'group_id'),
+    }),
+    (Post, 'pk', {
+        'comments_count': (Comment, 'post_id'),
+    }),
+)
+
+
+def batches(queryset, batch_size):
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        ids = list(page.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last_pk = ids[-1]
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счётчики с данными и чинит расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не меняя')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        if not dry_run:
+            self.create_missing_stats(batch_size)
+        for model, key, fields in COUNTERS:
+            fixed = 0
+            for ids in batches(model.objects.all(), batch_size):
+                fixed += self.repair_batch(model, key, fields, ids, dry_run)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: расхождений {fixed}')
+
+    def create_missing_stats(self, batch_size):
+        for ids in batches(User.objects.all(), batch_size):
+            existing = set(UserStats.objects.filter(
+                user_id__in=ids).values_list('user_id', flat=True))
+            UserStats.objects.bulk_create(
+                [UserStats(user_id=pk) for pk in ids if pk not in existing],
+                ignore_conflicts=True,
+            )
+
+    def repair_batch(self, model, key, fields, ids, dry_run):
+        actual = {}
+        for field, (source, foreign_key) in fields.items():
+            actual[field] = dict(
+                source.objects.filter(**{f'{foreign_key}__in': ids})
+                .order_by().values(foreign_key)
+                .annotate(total=Count('pk'))
+                .values_list(foreign_key, 'total'))
+        rows = model.objects.filter(pk__in=ids).values(key, *fields)
+        fixed = 0
+        for row in rows:
+            changes = {
+                field: actual[field].get(row[key], 0)
+                for field in fields
+                if row[field] != actual[field].get(row[key], 0)
+            }
+            if changes:
+                fixed += 1
+                if not dry_run:
+                    model.objects.filter(pk=row[key]).update(**changes)
+        return fixed
@@ -0,0 +1,114 @@
+import os
+import shutil
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.caching import bump_generations, post_generations
+from posts.counts import bump
+from posts.models import Post, StoredImage
+from posts.storage import HASH_RE, content_hash, is_sharded, sharded_name
+
+
+def target_name(storage, name):
+    """Имя файла в раскладке по хешу; старые имена без хеша хешируются."""
+    directory, filename = os.path.split(name)
+    digest, extension = os.path.splitext(filename)
+    if not HASH_RE.match(digest):
+        with storage.open(name) as content:
+            digest = content_hash(content)
+    return sharded_name(directory, digest, extension.lower())
+
+
+def link(old_path, new_path):
+    """
+    Делает файл доступным под новым путём, не удаляя старый: старый
+    удаляется только после того, как в базе записано новое имя.
+    """
+    if os.path.exists(new_path):
+        return
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    try:
+        os.link(old_path, new_path)
+    except OSError:
+        shutil.copy2(old_path, new_path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов из общего каталога в подкаталоги по '
+        'хешу и обновляет пути в базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать файлы, которые нужно перенести')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        storage = Post._meta.get_field('image').storage
+        moved = failed = 0
+        last_pk = 0
+        while True:
+            rows = list(StoredImage.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', 'name', 'refs')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            legacy = [row for row in rows if not is_sharded(row[1])]
+            if dry_run:
+                moved += len(legacy)
+                continue
+            renames = []
+            for pk, name, refs in legacy:
+                try:
+                    new_name = target_name(storage, name)
+                    link(storage.path(name), storage.path(new_name))
+                except (OSError, SuspiciousFileOperation) as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                renames.append((pk, name, new_name, refs))
+            self.rename(storage, renames)
+            moved += len(renames)
+            self.stdout.write(f'Перенесено {moved}, ошибок {failed}')
+        if dry_run:
+            self.stdout.write(f'Нужно перенести файлов: {moved}')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено {moved}, ошибок {failed}. Миниатюры постов без '
+            f'вариантов создаст backfill_thumbnails'))
+
+    def rename(self, storage, renames):
+        if not renames:
+            return
+        with transaction.atomic():
+            for pk, name, new_name, refs in renames:
+                Post.objects.filter(image=name).update(
+                    image=new_name, modified=timezone.now())
+                # Пока шёл перенос, такую же картинку могли загрузить
+                # заново: тогда ссылки переходят к её записи.
+                existing = StoredImage.objects.filter(name=new_name)
+                if bump(existing, refs, 'refs'):
+                    StoredImage.objects.filter(pk=pk).delete()
+                else:
+                    StoredImage.objects.filter(pk=pk).update(name=new_name)
+        scopes = set()
+        posts = Post.objects.filter(
+            image__in=[new_name for _, _, new_name, _ in renames]
+        ).select_related('author', 'group')
+        for post in posts.iterator():
+            scopes.update(post_generations(post))
+        bump_generations(*scopes)
+        for _, name, _, _ in renames:
+            # Миниатюры sorl привязаны к имени исходника: записи о них
+            # больше не найдутся, а файлы из вариантов постов остаются.
+            default.kvstore.delete(ImageFile(name, storage))
+            try:
+                os.remove(storage.path(name))
+            except FileNotFoundError:
+                pass
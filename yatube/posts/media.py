@@ -0,0 +1,44 @@
+import logging
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from sorl.thumbnail import delete as delete_with_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from .counts import bump
+from .models import Post, StoredImage
+
+logger = logging.getLogger(__name__)
+
+
+def retain_image(name):
+    if not name:
+        return
+    images = StoredImage.objects.filter(name=name)
+    if not bump(images, 1, 'refs'):
+        StoredImage.objects.get_or_create(name=name)
+        bump(images, 1, 'refs')
+
+
+def release_image(name):
+    """
+    Снимает ссылку на файл. Последняя ссылка удаляет файл вместе с его
+    миниатюрами после коммита, если к тому времени файл снова никому не
+    понадобился.
+    """
+    if not name:
+        return
+    images = StoredImage.objects.filter(name=name)
+    bump(images, -1, 'refs')
+    if images.filter(refs=0).delete()[0]:
+        transaction.on_commit(lambda: _delete_unused(name))
+
+
+def _delete_unused(name):
+    if StoredImage.objects.filter(name=name).exists():
+        return
+    storage = Post._meta.get_field('image').storage
+    try:
+        delete_with_thumbnails(ImageFile(name, storage))
+    except (SuspiciousFileOperation, OSError):
+        logger.exception('Could not delete unused image %s', name)
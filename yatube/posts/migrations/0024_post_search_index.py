@@ -0,0 +1,77 @@
+import re
+
+from django.db import migrations
+
+# Копия таблицы и разбора текста из posts.search на момент миграции:
+# дальнейшие правки приложения не должны менять уже применённую миграцию.
+SEARCH_TABLE = 'posts_post_fts'
+INDEX_BATCH = 1000
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иям', 'ием', 'иях', 'ией',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ться', 'тся',
+    'ешь', 'ете', 'ите', 'ишь', 'ует', 'уют', 'ают', 'яют', 'ает', 'яет',
+    'ать', 'ять', 'ить', 'еть', 'ыть', 'ала', 'яла', 'ила', 'ела', 'ыла',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев',
+    'ю', 'я', 'ы', 'и', 'а', 'е', 'о', 'у', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def index_text(text):
+    return ' '.join(stem(word) for word in WORD_RE.findall(text))
+
+
+def index_posts(schema_editor, rows):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, text) '
+            'VALUES (%s, %s)',
+            [(pk, index_text(text)) for pk, text in rows])
+
+
+def build_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        f"text, tokenize='unicode61 remove_diacritics 2')")
+    rows = []
+    for row in Post.objects.values_list('pk', 'text').iterator():
+        rows.append(row)
+        if len(rows) >= INDEX_BATCH:
+            index_posts(schema_editor, rows)
+            rows = []
+    if rows:
+        index_posts(schema_editor, rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_post_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:16
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import migrations, models
+from PIL import Image
+
+
+def fill_image_size(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    storage = Post._meta.get_field('image').storage
+    names = list(Post.objects.exclude(image='').order_by().values_list(
+        'image', flat=True).distinct())
+    for name in names:
+        try:
+            with storage.open(name) as image:
+                width, height = Image.open(image).size
+        except (OSError, SyntaxError, ValueError, SuspiciousFileOperation):
+            continue
+        Post.objects.filter(image=name).update(
+            image_width=width, image_height=height)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0026_stored_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.RunPython(fill_image_size, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,11 @@
+import json
+
 from core.models import CreatedModel
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 
 User = get_user_model()
 
@@ -11,6 +15,11 @@ class Group(models.Model):
     title = models.CharField(max_length=200,)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число постов',
+        default=0,
+        editable=False,
+    )
 
     def __str__(self):
         return self.title
@@ -42,16 +51,52 @@ class Post(CreatedModel):
         verbose_name='Картинка',
         help_text='Загрузите картинку',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
+        db_index=True,
         blank=True,)
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина картинки',
+        blank=True, null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота картинки',
+        blank=True, null=True,
+        editable=False,
+    )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Число комментариев',
+        default=0,
+        editable=False,
+    )
+    modified = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    image_variants = models.TextField(
+        verbose_name='Варианты картинки',
+        help_text='JSON: формат -> список [ширина, высота, файл]',
+        blank=True,
+        default='',
+        editable=False,
+    )
 
     class Meta:
-        ordering = ["-created"]
+        ordering = ["-created", "-id"]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['author', '-created'], name='post_author_created')
+        ]
 
     def __str__(self):
         return self.text[:self.SYMBOLS_LIMIT]
 
+    @property
+    def variants(self):
+        return json.loads(self.image_variants) if self.image_variants else {}
+
 
 class Comment(CreatedModel):
 
@@ -97,3 +142,88 @@ class Follow(models.Model):
             models.UniqueConstraint(
                 fields=['user', 'author'], name='follow_row')
         ]
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        verbose_name='Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE,
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+        on_delete=models.CASCADE,
+    )
+    created = models.DateTimeField(verbose_name='Дата создания поста')
+
+    class Meta:
+        ordering = ["-created", "-post"]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='timeline_row')
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created'], name='timeline_user_created')
+        ]
+
+
+class PulledAuthor(models.Model):
+    """Автор, чьи посты не раскладываются по лентам, а читаются при показе."""
+
+    author = models.OneToOneField(
+        User,
+        related_name='pulled_feed',
+        verbose_name='Автор',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Популярный автор'
+        verbose_name_plural = 'Популярные авторы'
+
+
+class StoredImage(models.Model):
+    """Число постов, ссылающихся на файл картинки в хранилище."""
+
+    name = models.CharField(
+        verbose_name='Файл',
+        max_length=255,
+        unique=True,
+    )
+    refs = models.PositiveIntegerField(
+        verbose_name='Число ссылок',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import Signer
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image, ImageOps
+
+SPEC_RE = re.compile(r'^(\d+)x(\d+)(c?)$')
+
+RESIZE_QUALITY = 80
+RESIZE_LOCK_TIMEOUT = 30
+RESIZE_WAIT = 5
+RESIZE_POLL = 0.05
+# Доля предела, до которой кэш очищается при переполнении: так очистка
+# запускается реже, чем при каждой новой картинке.
+EVICT_TO = 0.9
+# Общий для воркеров счётчик байт в дисковом кэше вариантов.
+CACHE_SIZE_KEY = 'resize:bytes'
+EVICT_LOCK_TIMEOUT = 5 * 60
+
+signer = Signer(salt='posts.resize')
+
+
+def make_spec(width, height, crop=False):
+    return f'{width}x{height}{"c" if crop else ""}'
+
+
+def parse_spec(spec):
+    """(ширина, высота, кадрировать) или None для неверного размера."""
+    match = SPEC_RE.match(spec)
+    if not match:
+        return None
+    width, height = int(match.group(1)), int(match.group(2))
+    if not (0 < width <= settings.RESIZE_MAX_SIDE
+            and 0 < height <= settings.RESIZE_MAX_SIDE):
+        return None
+    return width, height, bool(match.group(3))
+
+
+def sign(post_id, spec):
+    return signer.signature(f'{post_id}/{spec}')
+
+
+def check_signature(post_id, spec, signature):
+    return constant_time_compare(sign(post_id, spec), signature)
+
+
+def resize_url(post_id, width, height, crop=False):
+    spec = make_spec(width, height, crop)
+    return reverse(
+        'posts:resize_image', args=(post_id, spec, sign(post_id, spec)))
+
+
+def variant_key(image_name, spec):
+    """
+    Ключ варианта. Имя картинки - хеш её содержимого, поэтому ключ
+    меняется вместе с картинкой и годится как сильный ETag.
+    """
+    return hashlib.sha256(
+        f'{image_name}|{spec}|{RESIZE_QUALITY}'.encode()).hexdigest()
+
+
+def variant_path(key):
+    return os.path.join(
+        settings.RESIZE_CACHE_DIR, key[:2], key[2:4], f'{key}.jpg')
+
+
+def render_variant(image_file, width, height, crop):
+    with image_file.open('rb') as source:
+        image = Image.open(source)
+        image.draft('RGB', (width, height))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    if crop:
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        image.thumbnail((width, height), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(
+        buffer, 'JPEG', quality=RESIZE_QUALITY, optimize=True,
+        progressive=True)
+    return buffer.getvalue()
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as temp_file:
+        temp_file.write(data)
+    os.replace(temp_path, path)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def get_variant(image_file, spec):
+    """
+    Путь к варианту картинки в дисковом кэше; вариант создаётся при
+    первом запросе. Его создаёт только запрос, взявший блокировку, а
+    остальные ждут готовый файл.
+    """
+    width, height, crop = parse_spec(spec)
+    key = variant_key(image_file.name, spec)
+    path = variant_path(key)
+    if _touch(path):
+        return key, path
+    lock_key = f'resize:{key}:lock'
+    locked = cache.add(lock_key, 1, RESIZE_LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + RESIZE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(RESIZE_POLL)
+            if os.path.exists(path):
+                return key, path
+    try:
+        if not os.path.exists(path):
+            data = render_variant(image_file, width, height, crop)
+            _write_atomic(path, data)
+            if grow_cache_size(len(data)) > settings.RESIZE_CACHE_MAX_BYTES:
+                evict()
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return key, path
+
+
+def _cached_files():
+    """(время изменения, размер, путь) всех файлов кэша вариантов."""
+    for root, _, names in os.walk(settings.RESIZE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def grow_cache_size(size):
+    """
+    Прибавляет size к счётчику размера кэша и возвращает новый размер.
+    Без счётчика (после очистки кэша) размер один раз считается обходом
+    каталога, в котором уже лежит новый файл.
+    """
+    try:
+        return cache.incr(CACHE_SIZE_KEY, size)
+    except ValueError:
+        cache.add(CACHE_SIZE_KEY, sum(
+            size for _, size, _ in _cached_files()), None)
+        return cache.incr(CACHE_SIZE_KEY, 0)
+
+
+def evict(max_bytes=None):
+    """
+    Удаляет давно не запрошенные варианты (по времени изменения файла,
+    которое обновляется при каждом чтении), пока кэш больше предела, и
+    сверяет счётчик размера с диском. Каталог обходит один процесс, а
+    запускается очистка, только когда счётчик перешёл предел.
+    """
+    max_bytes = max_bytes or settings.RESIZE_CACHE_MAX_BYTES
+    lock_key = f'{CACHE_SIZE_KEY}:lock'
+    if not cache.add(lock_key, 1, EVICT_LOCK_TIMEOUT):
+        return
+    try:
+        files = list(_cached_files())
+        total = sum(size for _, size, _ in files)
+        if total > max_bytes:
+            files.sort()
+            for _, size, path in files:
+                if total <= max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        # Варианты, записанные во время обхода, в итог не попали: счётчик
+        # отстанет на них до следующей очистки.
+        cache.set(CACHE_SIZE_KEY, total, None)
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,142 @@
+import base64
+import binascii
+import re
+
+from django.db import connection
+
+from .models import Post
+from .utils import LIST_RELATED, POSTS_LIMIT
+
+
+SEARCH_TABLE = 'posts_post_fts'
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+# Окончания русских слов, от длинных к коротким. Это не полный стеммер:
+# достаточно, чтобы «котами», «коты» и «кот» давали одну основу. Миграция
+# 0024 строит индекс своей копией stem: после правок здесь индекс нужно
+# перестроить.
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иям', 'ием', 'иях', 'ией',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ться', 'тся',
+    'ешь', 'ете', 'ите', 'ишь', 'ует', 'уют', 'ают', 'яют', 'ает', 'яет',
+    'ать', 'ять', 'ить', 'еть', 'ыть', 'ала', 'яла', 'ила', 'ела', 'ыла',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев',
+    'ю', 'я', 'ы', 'и', 'а', 'е', 'о', 'у', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def index_text(text):
+    """Текст для индекса: основы слов через пробел."""
+    return ' '.join(stem(word) for word in WORD_RE.findall(text))
+
+
+def match_expression(query):
+    """Запрос FTS5: все основы из запроса как префиксы, через AND."""
+    stems = [stem(word) for word in WORD_RE.findall(query)]
+    return ' '.join('"{}"*'.format(s.replace('"', '""')) for s in stems)
+
+
+def has_search_index():
+    return connection.vendor == 'sqlite'
+
+
+def index_posts(rows):
+    """Добавляет в индекс пары (id, текст), заменяя прежние версии."""
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, text) '
+            'VALUES (%s, %s)',
+            [(pk, index_text(text)) for pk, text in rows])
+
+
+def index_post(post):
+    if has_search_index():
+        index_posts([(post.pk, post.text)])
+
+
+def unindex_post(post_id):
+    if has_search_index():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post_id])
+
+
+def match_ids_sql(query):
+    return (
+        f'SELECT rowid FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s', [match_expression(query)])
+
+
+def encode_search_cursor(score, pk):
+    raw = f'{score!r}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_search_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        score, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        return float(score), int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def _ranked_ids(query, cursor, limit):
+    sql = (
+        f'SELECT rowid, bm25({SEARCH_TABLE}) AS score FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s')
+    params = [match_expression(query)]
+    if cursor:
+        sql = f'SELECT * FROM ({sql}) WHERE (score, rowid) > (%s, %s)'
+        params += list(cursor)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(
+            f'{sql} ORDER BY score, rowid LIMIT %s', params + [limit])
+        return [(pk, score) for pk, score in db_cursor.fetchall()]
+
+
+def _recent_ids(query, cursor, limit):
+    # Без полнотекстового индекса: совпадения по подстроке, новые первыми.
+    posts = Post.objects.filter(text__icontains=query)
+    if cursor:
+        posts = posts.filter(pk__lt=cursor[1])
+    return [
+        (pk, 0.0) for pk in posts.order_by('-pk').values_list(
+            'pk', flat=True)[:limit]]
+
+
+def search_posts(query, after=None, limit=POSTS_LIMIT):
+    """
+    Страница результатов поиска, упорядоченных по релевантности (bm25),
+    и курсор следующей страницы. Курсор - пара (оценка, id) последнего
+    результата, поэтому глубокие страницы не требуют OFFSET.
+    """
+    if not WORD_RE.search(query):
+        return [], None
+    if has_search_index():
+        found = _ranked_ids(query, after, limit + 1)
+    else:
+        found = _recent_ids(query, after, limit + 1)
+    next_cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        next_cursor = encode_search_cursor(found[-1][1], found[-1][0])
+    posts = Post.objects.select_related(*LIST_RELATED).in_bulk(
+        [pk for pk, _ in found])
+    return [posts[pk] for pk, _ in found if pk in posts], next_cursor
@@ -0,0 +1,270 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from .autocomplete import GROUP, USER, index_group, index_user, unindex
+from .caching import (
+    INDEX_GENERATION, author_card_generation, bump_generations,
+    group_card_generation, group_generation, post_generation,
+    post_generations, profile_generation)
+from .counts import (
+    INDEX_SCOPE, adjust_counts, bump_group, bump_post, bump_user)
+from .feeds import (
+    backfill_timeline, classify_author, fan_out_post, forget_author_list,
+    prune_timeline)
+from .media import release_image, retain_image
+from .models import Comment, Follow, Group, Post, UserStats
+from .search import index_post, unindex_post
+from .thumbnails import schedule_thumbnails, share_variants
+from .uploads import image_size
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, **kwargs):
+    instance._old_group_id = instance._old_image = None
+    if instance.pk:
+        instance._old_group_id, instance._old_image = Post.objects.filter(
+            pk=instance.pk).values_list('group_id', 'image').first() or (
+                None, None)
+    if instance.image.name != instance._old_image:
+        instance.image_width, instance.image_height = image_size(
+            instance.image)
+
+
+@receiver(post_save, sender=Post)
+def update_post_counts(sender, instance, created, **kwargs):
+    if created:
+        adjust_counts([INDEX_SCOPE], 1)
+        bump_user(instance.author_id, 1, 'posts_count')
+        bump_group(instance.group_id, 1)
+        return
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if old_group_id != instance.group_id:
+        bump_group(old_group_id, -1)
+        bump_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def decrease_post_counts(sender, instance, **kwargs):
+    adjust_counts([INDEX_SCOPE], -1)
+    bump_user(instance.author_id, -1, 'posts_count')
+    bump_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def increase_comments_count(sender, instance, created, **kwargs):
+    if created:
+        bump_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrease_comments_count(sender, instance, **kwargs):
+    bump_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        forget_author_list(instance.author_id)
+        fan_out_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleted_post(sender, instance, **kwargs):
+    forget_author_list(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, **kwargs):
+    old_image = getattr(instance, '_old_image', None) or None
+    if instance.image.name != old_image:
+        retain_image(instance.image.name)
+        release_image(old_image)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+def pregenerate_thumbnails(sender, instance, **kwargs):
+    # До сохранения имя загрузки ещё не хеш содержимого, поэтому замену
+    # картинки видно только здесь: та же картинка получит то же имя.
+    if instance.image.name == getattr(instance, '_old_image', None):
+        return
+    if instance.image_variants:
+        # Варианты старой картинки не подходят новой.
+        instance.image_variants = ''
+        Post.objects.filter(pk=instance.pk).update(image_variants='')
+    if instance.image and not share_variants(instance):
+        schedule_thumbnails(instance)
+
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, **kwargs):
+    index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def fill_follower_timeline(sender, instance, created, **kwargs):
+    if created:
+        bump_user(instance.user_id, 1, 'following_count')
+        bump_user(instance.author_id, 1, 'followers_count')
+        classify_author(instance.author_id)
+        backfill_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_follower_timeline(sender, instance, **kwargs):
+    bump_user(instance.user_id, -1, 'following_count')
+    bump_user(instance.author_id, -1, 'followers_count')
+    prune_timeline(instance.user_id, instance.author_id)
+    classify_author(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def expire_post_pages(sender, instance, created, **kwargs):
+    scopes = post_generations(instance)
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if old_group_id and old_group_id != instance.group_id:
+        scopes += [
+            group_generation(slug) for slug in Group.objects.filter(
+                pk=old_group_id).values_list('slug', flat=True)]
+    bump_generations(*scopes)
+
+
+@receiver(post_delete, sender=Post)
+def expire_deleted_post_pages(sender, instance, **kwargs):
+    bump_generations(*post_generations(instance))
+
+
+@receiver(post_save, sender=Group)
+def expire_group_page(sender, instance, **kwargs):
+    bump_generations(group_generation(instance.slug))
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_authors(sender, instance, **kwargs):
+    # Посты отвязываются от группы через SET_NULL одним UPDATE, без
+    # сигналов постов, поэтому авторов нужно найти до удаления.
+    instance._author_usernames = list(Post.objects.filter(
+        group=instance).values_list('author__username', flat=True).distinct())
+
+
+@receiver(post_delete, sender=Group)
+def expire_deleted_group_pages(sender, instance, **kwargs):
+    usernames = getattr(instance, '_author_usernames', [])
+    bump_generations(
+        INDEX_GENERATION, group_generation(instance.slug),
+        *(profile_generation(username) for username in usernames))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def expire_follow_profiles(sender, instance, **kwargs):
+    bump_generations(
+        profile_generation(instance.user.username),
+        profile_generation(instance.author.username))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_post_detail(sender, instance, **kwargs):
+    bump_generations(post_generation(instance.post_id))
+
+
+def _touches(fields, update_fields):
+    return update_fields is None or bool(set(fields) & set(update_fields))
+
+
+# Поля пользователя, которые видны в карточках его постов.
+CARD_USER_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, update_fields=None, **kwargs):
+    instance._old_username = instance._old_card_fields = None
+    if instance.pk and _touches(CARD_USER_FIELDS, update_fields):
+        instance._old_card_fields = User.objects.filter(
+            pk=instance.pk).values_list(*CARD_USER_FIELDS).first()
+        if instance._old_card_fields:
+            instance._old_username = instance._old_card_fields[0]
+
+
+@receiver(post_save, sender=User)
+def expire_author_cards(sender, instance, created, **kwargs):
+    old_fields = getattr(instance, '_old_card_fields', None)
+    fields = tuple(getattr(instance, field) for field in CARD_USER_FIELDS)
+    if created or not old_fields or old_fields == fields:
+        return
+    # Страницы, где видны карточки автора, тоже устарели.
+    slugs = Post.objects.filter(author=instance).exclude(
+        group=None).values_list('group__slug', flat=True).distinct()
+    bump_generations(
+        author_card_generation(instance.pk), INDEX_GENERATION,
+        profile_generation(instance.username),
+        *(group_generation(slug) for slug in slugs))
+
+
+@receiver(post_save, sender=User)
+def update_user_autocomplete(sender, instance, created, **kwargs):
+    old_username = getattr(instance, '_old_username', None)
+    if created:
+        index_user(instance)
+    elif old_username and old_username != instance.username:
+        unindex(USER, old_username)
+        index_user(instance, UserStats.objects.filter(
+            user=instance).values_list('followers_count', flat=True).first())
+
+
+@receiver(post_delete, sender=User)
+def remove_user_autocomplete(sender, instance, **kwargs):
+    unindex(USER, instance.username)
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_slug(sender, instance, **kwargs):
+    instance._old_slug = None
+    if instance.pk:
+        instance._old_slug = Group.objects.filter(
+            pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+def expire_group_cards(sender, instance, **kwargs):
+    old_slug = getattr(instance, '_old_slug', None)
+    if not old_slug or old_slug == instance.slug:
+        return
+    usernames = Post.objects.filter(group=instance).values_list(
+        'author__username', flat=True).distinct()
+    bump_generations(
+        group_card_generation(instance.pk), INDEX_GENERATION,
+        *(profile_generation(username) for username in usernames))
+
+
+@receiver(post_save, sender=Group)
+def update_group_autocomplete(sender, instance, **kwargs):
+    old_slug = getattr(instance, '_old_slug', None)
+    if old_slug and old_slug != instance.slug:
+        unindex(GROUP, old_slug)
+    index_group(instance)
+
+
+@receiver(post_delete, sender=Group)
+def remove_group_autocomplete(sender, instance, **kwargs):
+    unindex(GROUP, instance.slug)
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK = 64 * 1024
+# Файлы раскладываются по каталогам из первых символов хеша: ab/cd/abcd...
+# Каталогов 256 * 256, поэтому в каждом остаются сотни файлов даже при
+# сотнях миллионов картинок.
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def sharded_name(directory, digest, extension):
+    shards = [
+        digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH]
+        for level in range(SHARD_LEVELS)]
+    return '/'.join([directory, *shards, digest + extension])
+
+
+def is_sharded(name):
+    """Лежит ли файл в каталоге своего хеша (имя от sharded_name)."""
+    parts = name.split('/')
+    digest = os.path.splitext(parts[-1])[0]
+    return (
+        len(parts) > SHARD_LEVELS and HASH_RE.match(digest) is not None
+        and sharded_name(
+            '/'.join(parts[:-SHARD_LEVELS - 1]), digest,
+            os.path.splitext(parts[-1])[1]) == name)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором файл называется по хешу своего содержимого в
+    каталоге upload_to. Одинаковые загрузки получают одно имя и один файл
+    на диске, а значит и общие миниатюры sorl: их имена считаются от
+    имени исходника. Учёт ссылок на файлы ведёт модель StoredImage.
+
+    Внутри upload_to файлы лежат в подкаталогах по первым символам хеша
+    (sharded_name), чтобы ни один каталог не разрастался.
+    """
+
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return sharded_name(directory, content_hash(content), extension)
+
+    def get_available_name(self, name, max_length=None):
+        if is_sharded(name):
+            # Имя по хешу занято файлом с тем же содержимым: другое имя
+            # сломало бы и общий файл, и раскладку по хешу.
+            raise FileExistsError(name)
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            # Такую же картинку успела сохранить параллельная загрузка.
+            return name
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+from ..models import Post, StoredImage
+from .utils import image_upload
+
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+class BackfillThumbnailsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='archivist')
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user, text=f'Пост {name}', image=name)
+            for name in ('posts/a.jpg', 'posts/b.jpg')]
+        Post.objects.create(author=cls.user, text='Без картинки')
+
+    def setUp(self):
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir, ignore_errors=True)
+        self.checkpoint = os.path.join(checkpoint_dir, 'backfill.json')
+
+    def backfill(self):
+        with mock.patch(
+                'posts.management.commands.backfill_thumbnails.'
+                'generate_post_thumbnails') as generate:
+            call_command(
+                'backfill_thumbnails', workers=0, batch_size=1,
+                checkpoint=self.checkpoint, stdout=StringIO())
+        return [args[0] for args, _ in generate.call_args_list]
+
+    def test_resumes_after_checkpoint(self):
+        """Повторный запуск обрабатывает только новые посты с картинками."""
+        first, second = BackfillThumbnailsTests.posts
+        self.assertEqual(self.backfill(), [first.pk, second.pk])
+        self.assertEqual(self.backfill(), [])
+        third = Post.objects.create(
+            author=BackfillThumbnailsTests.user, text='Ещё',
+            image='posts/c.jpg')
+        self.assertEqual(self.backfill(), [third.pk])
+
+    def test_new_sizes_restart_backfill(self):
+        """После смены размеров миниатюр обход начинается сначала."""
+        self.backfill()
+        with self.settings(POST_IMAGE_WIDTHS=(320, 640)):
+            self.assertEqual(
+                self.backfill(),
+                [post.pk for post in BackfillThumbnailsTests.posts])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ShardMediaTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='librarian')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def legacy_post(self, name, content):
+        path = os.path.join(TEMP_MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as image:
+            image.write(content)
+        return Post.objects.create(
+            author=ShardMediaTests.user, text=name, image=name)
+
+    def test_flat_files_are_moved_to_shards(self):
+        """Файлы из общего каталога переносятся в подкаталоги по хешу."""
+        digest = hashlib.sha256(b'GIF89a-old').hexdigest()
+        old = self.legacy_post('posts/old.gif', b'GIF89a-old')
+        hashed = self.legacy_post(f'posts/{digest[::-1]}.gif', b'GIF89a-x')
+        out = StringIO()
+        call_command('shard_media', dry_run=True, stdout=out)
+        self.assertIn('Нужно перенести файлов: 2', out.getvalue())
+
+        call_command('shard_media', batch_size=1, stdout=StringIO())
+        old.refresh_from_db()
+        hashed.refresh_from_db()
+        reversed_digest = digest[::-1]
+        self.assertEqual(
+            old.image.name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
+        self.assertEqual(
+            hashed.image.name,
+            f'posts/{reversed_digest[:2]}/{reversed_digest[2:4]}/'
+            f'{reversed_digest}.gif')
+        for post in (old, hashed):
+            self.assertTrue(os.path.exists(post.image.path))
+            self.assertTrue(
+                StoredImage.objects.filter(name=post.image.name).exists())
+        self.assertFalse(
+            os.path.exists(os.path.join(TEMP_MEDIA_ROOT, 'posts/old.gif')))
+        self.assertEqual(StoredImage.objects.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='janitor')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, color):
+        post = Post.objects.create(
+            author=CollectMediaTests.user, text=color,
+            image=image_upload(f'{color}.png', (40, 20), color))
+        return post, get_thumbnail(post.image, '10x10').name
+
+    def write(self, name):
+        path = os.path.join(TEMP_MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as media:
+            media.write(b'junk')
+        return path
+
+    def test_unreferenced_media_is_collected(self):
+        """Удаляются только старые файлы без ссылок и записи sorl о них."""
+        kept, kept_thumbnail = self.upload('red')
+        deleted, deleted_thumbnail = self.upload('blue')
+        deleted_path = deleted.image.path
+        deleted.delete()
+        orphan = self.write('posts/00/00/orphan.png')
+        self.write('cache/ee/ee/variant.jpg')
+        Post.objects.filter(pk=kept.pk).update(
+            image_variants='{"JPEG": [[10, 5, "cache/ee/ee/variant.jpg"]]}')
+        self.write('cache/ff/ff/junk.jpg')
+        for root, _, names in os.walk(TEMP_MEDIA_ROOT):
+            for name in names:
+                os.utime(os.path.join(root, name), (0, 0))
+        fresh = self.write('posts/11/11/fresh.png')
+
+        out = StringIO()
+        call_command('collect_media', dry_run=True, stdout=out)
+        self.assertIn('Найдено картинок без постов: 2', out.getvalue())
+        self.assertTrue(os.path.exists(orphan))
+
+        call_command('collect_media', batch_size=2, stdout=StringIO())
+        media = {
+            os.path.relpath(os.path.join(root, name), TEMP_MEDIA_ROOT)
+            for root, _, names in os.walk(TEMP_MEDIA_ROOT) for name in names}
+        self.assertEqual(media, {
+            kept.image.name, kept_thumbnail, 'cache/ee/ee/variant.jpg',
+            'posts/11/11/fresh.png'})
+        self.assertFalse(os.path.exists(deleted_path))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertIsNone(default.kvstore.get(ImageFile(deleted.image.name)))
+        self.assertIsNotNone(default.kvstore.get(ImageFile(kept_thumbnail)))
+        self.assertNotIn(deleted_thumbnail, media)
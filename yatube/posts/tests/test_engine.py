@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+from sorl.thumbnail.base import ThumbnailBackend
+from ..thumbnail_engine import Engine
+from .utils import image_content
+
+
+class ThumbnailEngineTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.photo = image_content((4000, 3000), 'blue', 'JPEG')
+        cls.corpus = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        with open(os.path.join(cls.corpus, 'photo.jpg'), 'wb') as photo:
+            photo.write(cls.photo)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.corpus, ignore_errors=True)
+
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        """Большой JPEG декодируется уменьшенным, миниатюра нужного размера."""
+        engine = Engine()
+        image = engine.get_image(BytesIO(ThumbnailEngineTests.photo))
+        options = dict(
+            ThumbnailBackend.default_options, crop='center', upscale=True)
+        thumbnail = engine.create(image, (960, 339), options)
+        self.assertEqual(thumbnail.size, (960, 339))
+        self.assertEqual(image.size, (2000, 1500))
+
+    def test_benchmark_compares_engines(self):
+        """Бенчмарк печатает время обоих движков для каждой картинки."""
+        out = StringIO()
+        call_command(
+            'benchmark_thumbnails', ThumbnailEngineTests.corpus, repeat=1,
+            stdout=out)
+        self.assertIn('photo.jpg: pil', out.getvalue())
+        self.assertIn('Всего 1 картинок', out.getvalue())
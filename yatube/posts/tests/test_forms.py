@@ -1,11 +1,15 @@
 import shutil
 import tempfile
+from unittest import mock
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.files.uploadhandler import StopUpload
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from ..models import Group, Post, Comment
+from ..uploads import LimitedUploadHandler, upload_errors
+from .utils import image_upload
 
 
 User = get_user_model()
@@ -240,3 +244,78 @@ class CreateFormTests(TestCase):
         )
         self.assertEqual(Comment.objects.count(), comments_count, (
             'Ошибка. Количество постов не должно было изменится'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class UploadValidationTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(UploadValidationTests.user)
+
+    def upload(self):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            {'text': 'С картинкой', 'image': image_upload()})
+
+    def test_image_size_is_stored(self):
+        """Размеры загруженной картинки записываются в пост."""
+        self.upload()
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (20, 10))
+
+    def test_oversized_upload_is_rejected(self):
+        """Файл больше предела отклоняется, не доходя до Pillow."""
+        with self.settings(POST_IMAGE_MAX_BYTES=10), \
+                mock.patch('PIL.Image.open') as image_open:
+            response = self.upload()
+        image_open.assert_not_called()
+        self.assertIn(
+            'Файл больше', response.context['form'].errors['image'][0])
+        self.assertFalse(Post.objects.exists())
+
+    def test_rejection_is_shown_when_image_comes_first(self):
+        """
+        Ошибка видна, даже если картинка - первое поле запроса и после
+        отказа до остальных полей разбор не дошёл.
+        """
+        with self.settings(POST_IMAGE_MAX_BYTES=10):
+            response = self.authorized_client.post(
+                reverse('posts:post_create'),
+                {'image': image_upload(), 'text': 'С картинкой'})
+        form = response.context['form']
+        self.assertTrue(form.is_bound)
+        self.assertIn('Файл больше', form.errors['image'][0])
+        self.assertFalse(Post.objects.exists())
+
+    def test_large_dimensions_are_rejected_by_header(self):
+        """Слишком большая картинка отклоняется по заголовку."""
+        with self.settings(POST_IMAGE_MAX_SIDE=15), \
+                mock.patch('PIL.PngImagePlugin.PngImageFile.verify') as verify:
+            response = self.upload()
+        verify.assert_not_called()
+        self.assertIn(
+            'Картинка слишком большая',
+            response.context['form'].errors['image'][0])
+        self.assertFalse(Post.objects.exists())
+
+    def test_rejected_upload_stops_reading_request(self):
+        """После отказа обработчик не читает остаток тела запроса."""
+        request = RequestFactory().post('/create/')
+        handler = LimitedUploadHandler(request)
+        handler.new_file('image', 'big.png', 'image/png', None)
+        with self.settings(POST_IMAGE_MAX_BYTES=10):
+            with self.assertRaises(StopUpload) as stopped:
+                handler.receive_data_chunk(b'x' * 11, 0)
+        self.assertTrue(stopped.exception.connection_reset)
+        self.assertIn('Файл больше', upload_errors(request)['image'])
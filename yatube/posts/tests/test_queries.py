@@ -0,0 +1,100 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+from ..models import Comment, Follow, Group, Post, PulledAuthor
+from ..resize import sign
+from ..urls import urlpatterns
+from ..utils import POSTS_LIMIT
+from .utils import QueryBudgetMixin
+
+User = get_user_model()
+
+# Бюджет запросов для каждого адреса из posts/urls.py. Он не должен
+# зависеть от числа постов и комментариев на странице. Адреса, меняющие
+# подписки, проверяются последними.
+QUERY_BUDGETS = {
+    'index': 5,
+    'group_list': 5,
+    'profile': 6,
+    'post_detail': 5,
+    'post_comments': 3,
+    'follow_index': 4,
+    'search': 3,
+    'autocomplete': 4,
+    'resize_image': 3,
+    'post_create': 3,
+    'post_edit': 4,
+    'add_comment': 3,
+    'profile_unfollow': 10,
+    'profile_follow': 15,
+}
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='budget')
+        cls.author = User.objects.create_user(username='budget_author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='budget-slug',
+            description='Тестовое описание',)
+        Follow.objects.create(user=cls.user, author=cls.author)
+        # Посты популярных авторов лента читает при показе.
+        for number in range(3):
+            popular = User.objects.create_user(username=f'popular_{number}')
+            PulledAuthor.objects.create(author=popular)
+            Follow.objects.create(user=cls.user, author=popular)
+            for post_number in range(POSTS_LIMIT + 1):
+                Post.objects.create(
+                    author=popular, text=f'Популярный пост {post_number}')
+        for number in range(POSTS_LIMIT * 2):
+            cls.post = Post.objects.create(
+                author=cls.user if number % 2 else cls.author,
+                group=cls.group,
+                text=f'Пост {number}',
+            )
+        for number in range(POSTS_LIMIT * 2):
+            Comment.objects.create(
+                post=cls.post,
+                author=cls.author if number % 2 else cls.user,
+                text=f'Комментарий {number}',
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(QueryBudgetTests.user)
+
+    def get_url_args(self, name):
+        post = QueryBudgetTests.post
+        return {
+            'group_list': (QueryBudgetTests.group.slug,),
+            'profile': (QueryBudgetTests.author.username,),
+            'profile_follow': (QueryBudgetTests.author.username,),
+            'profile_unfollow': (QueryBudgetTests.author.username,),
+            'post_detail': (post.pk,),
+            'post_comments': (post.pk,),
+            'add_comment': (post.pk,),
+            'post_edit': (post.pk,),
+            'resize_image': (post.pk, '10x10', sign(post.pk, '10x10')),
+        }.get(name)
+
+    def test_every_url_has_query_budget(self):
+        """Для каждого адреса приложения posts задан бюджет запросов."""
+        for pattern in urlpatterns:
+            with self.subTest(name=pattern.name):
+                self.assertIn(pattern.name, QUERY_BUDGETS, (
+                    f'Добавьте бюджет запросов для posts:{pattern.name}'))
+
+    def test_urls_stay_within_query_budget(self):
+        """Страницы не делают отдельных запросов на каждый пост."""
+        for name, budget in QUERY_BUDGETS.items():
+            url = reverse(f'posts:{name}', args=self.get_url_args(name))
+            with self.subTest(url=url):
+                cache.clear()
+                with self.assertMaxQueries(budget):
+                    self.authorized_client.get(url)
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from ..models import Post, StoredImage
+from ..storage import ContentAddressedStorage
+
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='memelord')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, name, content=b'GIF89a-meme'):
+        return Post.objects.create(
+            author=ContentAddressedStorageTests.user, text=name,
+            image=SimpleUploadedFile(name, content, content_type='image/gif'))
+
+    def test_identical_uploads_share_one_file(self):
+        """Одинаковые загрузки хранятся одним файлом с учётом ссылок."""
+        first = self.upload('meme.GIF')
+        second = self.upload('copy.gif')
+        other = self.upload('other.gif', b'GIF89a-other')
+        digest = hashlib.sha256(b'GIF89a-meme').hexdigest()
+        self.assertEqual(
+            first.image.name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertNotEqual(other.image.name, first.image.name)
+        stored = [
+            name for _, _, names in os.walk(
+                os.path.join(TEMP_MEDIA_ROOT, 'posts')) for name in names]
+        self.assertEqual(len(stored), 2)
+        self.assertEqual(
+            StoredImage.objects.get(name=first.image.name).refs, 2)
+
+    def test_racing_identical_uploads_keep_hashed_name(self):
+        """Загрузка, опоздавшая с тем же файлом, получает то же имя."""
+        first = self.upload('meme.gif')
+        exists = ContentAddressedStorage.exists
+        checked = []
+
+        def not_yet_saved(storage, name):
+            # Файл появляется между проверкой имени и записью.
+            if name == first.image.name and not checked:
+                checked.append(name)
+                return False
+            return exists(storage, name)
+
+        with mock.patch.object(
+                ContentAddressedStorage, 'exists', not_yet_saved):
+            second = self.upload('copy.gif')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(first.image.path)),
+            [os.path.basename(first.image.name)])
+
+    def test_duplicate_reuses_variants(self):
+        """Копия картинки получает готовые варианты без новой обработки."""
+        first = self.upload('meme.gif')
+        Post.objects.filter(pk=first.pk).update(
+            image_variants='{"JPEG": [[2, 1, "cache/meme.jpg"]]}')
+        with mock.patch('posts.signals.schedule_thumbnails') as schedule:
+            second = self.upload('again.gif')
+        schedule.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.variants, first.variants)
+
+    def test_same_image_reupload_keeps_variants(self):
+        """Повторная загрузка той же картинки не сбрасывает варианты."""
+        post = self.upload('meme.gif')
+        variants = '{"JPEG": [[2, 1, "cache/meme.jpg"]]}'
+        Post.objects.filter(pk=post.pk).update(image_variants=variants)
+        post.refresh_from_db()
+        post.image = SimpleUploadedFile(
+            'again.gif', b'GIF89a-meme', content_type='image/gif')
+        with mock.patch('posts.signals.schedule_thumbnails') as schedule:
+            post.save()
+        schedule.assert_not_called()
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, variants)
+        self.assertEqual(StoredImage.objects.get(name=post.image.name).refs, 1)
+
+    def test_last_reference_deletes_file(self):
+        """Файл удаляется, когда на него не ссылается ни один пост."""
+        first = self.upload('meme.gif')
+        second = self.upload('copy.gif')
+        path = first.image.path
+        with mock.patch(
+                'posts.media.transaction.on_commit',
+                side_effect=lambda callback: callback()):
+            first.delete()
+            self.assertTrue(os.path.exists(path))
+            second.image = ''
+            second.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(StoredImage.objects.exists())
@@ -1,14 +1,30 @@
+import os
 import shutil
 import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django import forms
-from ..models import Group, Post, Follow
-from ..utils import POSTS_LIMIT
+from PIL import Image
+from core.templatetags.post_cards import card_key
+from ..autocomplete import prefix_index
+from ..counts import INDEX_SCOPE, get_count
+from ..feeds import get_author_lists, trim_timelines
+from ..models import (
+    Comment, Group, Post, Follow, PulledAuthor, TimelineEntry, UserStats)
+from ..resize import evict, resize_url, sign, variant_key, variant_path
+from ..thumbnails import generate_post_thumbnails, ready_thumbnail
+from ..utils import COMMENTS_LIMIT, POSTS_LIMIT, encode_cursor
+from .utils import SMALL_GIF, image_upload
 
 
 User = get_user_model()
@@ -91,6 +107,57 @@ class PaginatorViwesTest(TestCase):
                     f'Ошибка. Количество постов на второй странице не равно'
                     f'{OVER_POSTS_LIMIT}'))
 
+    def test_keyset_pages_follow_cursors(self):
+        """
+        Переход по курсорам ?after= и ?before= возвращает те же записи,
+        что и постраничный вывод по номерам страниц.
+        """
+        group = PaginatorViwesTest.group
+        author = PaginatorViwesTest.user
+
+        address_list = [
+            ('posts:index', None),
+            ('posts:group_list', (group.slug,)),
+            ('posts:profile', (author.username,)),
+        ]
+        for address, args in address_list:
+            url = reverse(address, args=args)
+            with self.subTest(url=url):
+                first_page = self.guest_client.get(url).context['page_obj']
+                next_cursor = first_page.next_cursor
+                second_page = self.guest_client.get(
+                    f'{url}?after={next_cursor}').context['page_obj']
+                self.assertEqual(len(second_page), OVER_POSTS_LIMIT)
+                self.assertFalse(second_page.has_next())
+                self.assertEqual(
+                    list(second_page),
+                    list(self.guest_client.get(
+                        f'{url}?page=2').context['page_obj']))
+
+                previous_cursor = second_page.previous_cursor
+                previous_page = self.guest_client.get(
+                    f'{url}?before={previous_cursor}').context['page_obj']
+                self.assertEqual(list(previous_page), list(first_page))
+                self.assertFalse(previous_page.has_previous())
+
+    def test_empty_keyset_page_has_no_cursor_links(self):
+        """Пустая страница по курсору не ссылается на другие страницы."""
+        newest = encode_cursor(PaginatorViwesTest.post)
+        response = self.guest_client.get(
+            reverse('posts:index') + f'?before={newest}')
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), 0)
+        self.assertFalse(page_obj.has_next())
+        self.assertFalse(page_obj.has_previous())
+        self.assertNotContains(response, '=None')
+
+    def test_keyset_invalid_cursor_shows_first_page(self):
+        """Испорченный курсор не ломает страницу, а ведёт на первую."""
+        response = self.guest_client.get(
+            reverse('posts:index') + '?after=broken')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page_obj']), POSTS_LIMIT)
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostViewsTests(TestCase):
@@ -309,15 +376,17 @@ class PostViewsTests(TestCase):
     def test_main_page_cache(self):
         """
         Проверка кеширования главной страницы. Логика теста:
-        при удалении записи из базы, она остаётся в response.content
-        главной страницы до тех пор, пока кэш не будет очищен принудительно.
+        изменение записи в обход сигналов остаётся невидимым, пока кэш не
+        очищен принудительно, а удаление записи сразу сбрасывает кэш.
         """
-        response_main_before_post_delete = self.authorized_client.get(
+        post = PostViewsTests.post
+
+        response_main_before_update = self.authorized_client.get(
             reverse('posts:index'))
 
-        Post.objects.get(pk=PostViewsTests.post.id).delete()
+        Post.objects.filter(pk=post.id).update(text='Тихая правка')
 
-        response_main_after_post_delete = self.authorized_client.get(
+        response_main_after_update = self.authorized_client.get(
             reverse('posts:index'))
 
         cache.clear()
@@ -325,17 +394,119 @@ class PostViewsTests(TestCase):
         response_main_after_cache_clear = self.authorized_client.get(
             reverse('posts:index'))
 
-        self.assertEqual(response_main_after_post_delete.content, (
-            response_main_before_post_delete.content), (
+        self.assertEqual(response_main_after_update.content, (
+            response_main_before_update.content), (
                 'Ошибка до очистки кеша. response.content главной страницы '
-                'до и после удаления поста не равны друг другу'))
+                'до и после изменения поста не равны друг другу'))
 
-        self.assertNotEqual(response_main_after_post_delete.content, (
-            response_main_after_cache_clear), (
+        self.assertNotEqual(response_main_after_update.content, (
+            response_main_after_cache_clear.content), (
                 'Ошибка после очистки кеша. response.content главной страницы '
-                'после удаления поста и после очистки кеша не должны быть '
+                'после изменения поста и после очистки кеша не должны быть '
                 'равны друг другу'))
 
+        Post.objects.get(pk=post.id).delete()
+
+        response_main_after_post_delete = self.authorized_client.get(
+            reverse('posts:index'))
+
+        self.assertNotIn(
+            'Тихая правка', response_main_after_post_delete.content.decode(), (
+                'Ошибка. Удалённый пост остался на закешированной главной '
+                'странице'))
+
+    def test_cached_pages_show_new_post_at_once(self):
+        """
+        Новый пост сразу виден на закешированных главной странице,
+        странице группы и профайле автора.
+        """
+        post = PostViewsTests.post
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(post.group.slug,)),
+            reverse('posts:profile', args=(post.author.username,)),
+        )
+        for url in urls:
+            self.authorized_client.get(url)
+
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Свежий пост', 'group': post.group.pk},
+            follow=True)
+        self.assertContains(response, 'Свежий пост')
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.authorized_client.get(url), 'Свежий пост')
+
+    def test_edited_post_card_is_rerendered(self):
+        """
+        Карточка поста кэшируется, а после правки в post_edit сразу
+        обновляется на всех страницах.
+        """
+        post = PostViewsTests.post
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(post.group.slug,)),
+            reverse('posts:profile', args=(post.author.username,)),
+        )
+        for url in urls:
+            self.authorized_client.get(url)
+        self.assertIsNotNone(cache.get(card_key(post, True)))
+
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=(post.pk,)),
+            data={'text': 'Исправленный текст', 'group': post.group.pk})
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.authorized_client.get(url), 'Исправленный текст')
+
+    def test_cards_follow_author_and_group_changes(self):
+        """
+        После смены адреса группы и имени автора их карточки и страницы
+        с ними рендерятся заново.
+        """
+        post = PostViewsTests.post
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=(post.author.username,)),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+
+        group = Group.objects.get(pk=post.group_id)
+        group.slug = 'renamed-slug'
+        group.save()
+        author = User.objects.get(pk=post.author_id)
+        author.first_name, author.last_name = 'Лев', 'Толстой'
+        author.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Лев Толстой')
+                self.assertContains(response, reverse(
+                    'posts:group_list', args=('renamed-slug',)))
+
+    def test_deleted_group_leaves_cached_pages(self):
+        """
+        После удаления группы закешированные страницы с её постами
+        больше не ссылаются на неё.
+        """
+        post = PostViewsTests.post
+        group_url = reverse('posts:group_list', args=(post.group.slug,))
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=(post.author.username,)),
+        )
+        for url in urls:
+            self.assertContains(self.guest_client.get(url), group_url)
+
+        Group.objects.get(pk=post.group_id).delete()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotContains(self.guest_client.get(url), group_url)
+
     def test_create_follow_row_authorized_client(self):
         """
         Проверка возможности авторизованного пользователя
@@ -424,3 +595,859 @@ class PostViewsTests(TestCase):
         self.assertNotIn(self.new_post, page_obj, (
             f'Ошибка. Новый пост автора не должен отображается в ленте новых '
             f'записей неподписчика {PostViewsTests.follower_user}'))
+
+
+class PostsCountersTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='counter')
+        cls.reader = User.objects.create_user(username='counter_reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='count-slug',
+            description='Тестовое описание',)
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-count-slug',
+            description='Тестовое описание',)
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Первый')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def assertCounters(self, posts, group_posts, comments):
+        user = PostsCountersTests.user
+        self.assertEqual(UserStats.objects.get(user=user).posts_count, posts)
+        self.assertEqual(Group.objects.get(
+            pk=PostsCountersTests.group.pk).posts_count, group_posts)
+        self.assertEqual(Post.objects.get(
+            pk=PostsCountersTests.post.pk).comments_count, comments)
+
+    def test_index_count_is_served_from_cache(self):
+        """
+        После первого запроса число постов главной страницы берётся из
+        кэша, а создание и удаление постов поддерживает его актуальным.
+        """
+        get_count(INDEX_SCOPE, Post.objects.all())
+
+        post = Post.objects.create(author=PostsCountersTests.user, text='2')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_count(INDEX_SCOPE, None), 2)
+
+        post.delete()
+        self.assertEqual(get_count(INDEX_SCOPE, None), 1)
+
+    def test_counters_follow_posts_and_comments(self):
+        """
+        Создание и удаление постов и комментариев обновляет счётчики
+        автора, группы и поста.
+        """
+        self.assertCounters(posts=1, group_posts=1, comments=0)
+
+        post = Post.objects.create(
+            author=PostsCountersTests.user,
+            group=PostsCountersTests.group,
+            text='Второй')
+        comment = Comment.objects.create(
+            post=PostsCountersTests.post,
+            author=PostsCountersTests.reader,
+            text='Комментарий')
+        self.assertCounters(posts=2, group_posts=2, comments=1)
+
+        post.delete()
+        comment.delete()
+        self.assertCounters(posts=1, group_posts=1, comments=0)
+
+    def test_group_change_moves_count(self):
+        """Перенос поста в другую группу переносит и его в счётчиках."""
+        post = Post.objects.get(pk=PostsCountersTests.post.pk)
+        post.group = PostsCountersTests.other_group
+        post.save()
+
+        self.assertEqual(Group.objects.get(
+            pk=PostsCountersTests.group.pk).posts_count, 0)
+        self.assertEqual(Group.objects.get(
+            pk=PostsCountersTests.other_group.pk).posts_count, 1)
+
+    def test_follow_counters(self):
+        """Подписка и отписка меняют число подписчиков и подписок."""
+        follow = Follow.objects.create(
+            user=PostsCountersTests.reader, author=PostsCountersTests.user)
+        response = self.guest_client.get(reverse(
+            'posts:profile', args=(PostsCountersTests.user.username,)))
+        self.assertEqual(response.context['stats'].followers_count, 1)
+        self.assertEqual(UserStats.objects.get(
+            user=PostsCountersTests.reader).following_count, 1)
+
+        follow.delete()
+        self.assertEqual(UserStats.objects.get(
+            user=PostsCountersTests.user).followers_count, 0)
+
+    def test_user_with_activity_can_be_deleted(self):
+        """
+        Удаление пользователя с постами, подписками и комментариями не
+        создаёт заново его счётчики.
+        """
+        author = User.objects.create_user(username='leaving')
+        post = Post.objects.create(
+            author=author, group=PostsCountersTests.group, text='Уйду')
+        Comment.objects.create(
+            post=PostsCountersTests.post, author=author, text='Пока')
+        Comment.objects.create(
+            post=post, author=PostsCountersTests.reader, text='Жаль')
+        Follow.objects.create(user=author, author=PostsCountersTests.user)
+        Follow.objects.create(user=PostsCountersTests.reader, author=author)
+
+        author.delete()
+        connection.check_constraints()
+
+        self.assertFalse(UserStats.objects.filter(user_id=author.pk).exists())
+        self.assertEqual(UserStats.objects.get(
+            user=PostsCountersTests.user).followers_count, 0)
+        self.assertEqual(UserStats.objects.get(
+            user=PostsCountersTests.reader).following_count, 0)
+        self.assertCounters(posts=1, group_posts=1, comments=0)
+
+    def test_profile_and_detail_run_no_aggregates(self):
+        """Страницы профиля и поста не выполняют COUNT-запросов."""
+        urls = (
+            reverse('posts:profile', args=(PostsCountersTests.user.username,)),
+            reverse('posts:post_detail', args=(PostsCountersTests.post.pk,)),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.guest_client.get(url)
+                self.assertEqual(response.context['posts_count'], 1)
+                for query in context.captured_queries:
+                    self.assertNotIn('COUNT(', query['sql'])
+
+    def test_repair_counters_command(self):
+        """Команда repair_counters исправляет рассинхронизацию счётчиков."""
+        UserStats.objects.filter(user=PostsCountersTests.user).update(
+            posts_count=10)
+        Group.objects.update(posts_count=7)
+        UserStats.objects.filter(user=PostsCountersTests.reader).delete()
+
+        call_command('repair_counters', batch_size=1, stdout=StringIO())
+
+        self.assertCounters(posts=1, group_posts=1, comments=0)
+        self.assertEqual(Group.objects.get(
+            pk=PostsCountersTests.other_group.pk).posts_count, 0)
+        self.assertTrue(UserStats.objects.filter(
+            user=PostsCountersTests.reader).exists())
+
+
+class FeedTimelineTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='timeline_author')
+        cls.reader = User.objects.create_user(username='timeline_reader')
+        cls.old_post = Post.objects.create(
+            author=cls.author, text='Пост до подписки')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(FeedTimelineTests.reader)
+
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        """
+        Подписка добавляет в ленту уже опубликованные посты автора,
+        отписка убирает их из ленты.
+        """
+        author = FeedTimelineTests.author
+        reader = FeedTimelineTests.reader
+
+        self.reader_client.get(
+            reverse('posts:profile_follow', args=(author.username,)))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=reader, post=FeedTimelineTests.old_post).exists())
+
+        self.reader_client.get(
+            reverse('posts:profile_unfollow', args=(author.username,)))
+        self.assertFalse(TimelineEntry.objects.filter(user=reader).exists())
+
+    def test_timeline_is_trimmed_to_bounded_length(self):
+        """Лента подписчика не растёт больше TIMELINE_LENGTH записей."""
+        author = FeedTimelineTests.author
+        reader = FeedTimelineTests.reader
+        Follow.objects.create(user=reader, author=author)
+
+        with mock.patch('posts.feeds.TIMELINE_LENGTH', 3), \
+                mock.patch('posts.feeds.TIMELINE_TRIM_EVERY', 1):
+            posts = [
+                Post.objects.create(author=author, text=f'Пост {number}')
+                for number in range(5)
+            ]
+
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), (
+            posts[:-4:-1]))
+
+    def test_timelines_are_trimmed_together_and_lazily(self):
+        """
+        Ленты всех подписчиков обрезаются одним запросом и не после
+        каждого поста.
+        """
+        author = FeedTimelineTests.author
+        readers = [FeedTimelineTests.reader] + [
+            User.objects.create_user(username=f'trimmed_{number}')
+            for number in range(2)]
+        for reader in readers:
+            Follow.objects.create(user=reader, author=author)
+        with mock.patch('posts.feeds.random.randrange', return_value=1):
+            for number in range(3):
+                Post.objects.create(author=author, text=f'Пост {number}')
+        self.assertEqual(
+            TimelineEntry.objects.count(),
+            Post.objects.filter(author=author).count() * len(readers))
+
+        with mock.patch('posts.feeds.TIMELINE_LENGTH', 2), \
+                self.assertNumQueries(1):
+            trim_timelines([reader.pk for reader in readers])
+        for reader in readers:
+            self.assertEqual(list(TimelineEntry.objects.filter(
+                user=reader).values_list('post', flat=True)), list(
+                    Post.objects.filter(author=author).values_list(
+                        'pk', flat=True)[:2]))
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_popular_author_is_pulled_at_read_time(self):
+        """
+        Посты автора с числом подписчиков выше порога не раскладываются
+        по лентам, но показываются подписчикам при чтении ленты.
+        """
+        author = FeedTimelineTests.author
+        reader = FeedTimelineTests.reader
+        other_reader = User.objects.create_user(username='other_reader')
+        Follow.objects.create(user=reader, author=author)
+        Follow.objects.create(user=other_reader, author=author)
+        self.assertTrue(PulledAuthor.objects.filter(author=author).exists())
+
+        new_post = Post.objects.create(author=author, text='Популярный пост')
+        self.assertFalse(
+            TimelineEntry.objects.filter(post=new_post).exists())
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertIn(new_post, response.context['page_obj'])
+
+        with mock.patch('posts.jobs.transaction.on_commit') as on_commit:
+            Follow.objects.get(user=other_reader, author=author).delete()
+            self.assertTrue(
+                PulledAuthor.objects.filter(author=author).exists())
+            on_commit.call_args[0][0]()
+        self.assertFalse(PulledAuthor.objects.filter(author=author).exists())
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=reader, post=new_post).exists())
+
+    @override_settings(FEED_PULL_THRESHOLD=1)
+    def test_feed_pages_merge_timeline_and_pulled_authors(self):
+        """
+        Страницы ленты по курсору сливают материализованную ленту с
+        последними постами популярных авторов без повторов.
+        """
+        author = FeedTimelineTests.author
+        reader = FeedTimelineTests.reader
+        regular = User.objects.create_user(username='regular_author')
+        Follow.objects.create(user=reader, author=regular)
+        for number in range(POSTS_LIMIT):
+            Post.objects.create(author=regular, text=f'Обычный {number}')
+        # Старый пост уже лежит в ленте: автор стал популярным позже.
+        TimelineEntry.objects.create(
+            user=reader, post=FeedTimelineTests.old_post,
+            created=FeedTimelineTests.old_post.created)
+        Follow.objects.create(user=reader, author=author)
+        self.assertTrue(PulledAuthor.objects.filter(author=author).exists())
+        for number in range(POSTS_LIMIT):
+            Post.objects.create(author=author, text=f'Популярный {number}')
+        expected = list(Post.objects.filter(author__in=(author, regular)))
+
+        url = reverse('posts:follow_index')
+        shown = []
+        response = self.reader_client.get(url)
+        while True:
+            page_obj = response.context['page_obj']
+            shown += list(page_obj)
+            if not page_obj.has_next():
+                break
+            response = self.reader_client.get(
+                f'{url}?after={page_obj.next_cursor}')
+        previous = self.reader_client.get(
+            f'{url}?before={page_obj.previous_cursor}')
+
+        self.assertEqual(shown, expected)
+        self.assertEqual(
+            list(previous.context['page_obj']),
+            expected[POSTS_LIMIT:POSTS_LIMIT * 2])
+
+    def test_author_lists_are_filled_by_one_query(self):
+        """
+        Списки авторов, которых нет в кэше, читаются одним запросом и
+        не длиннее AUTHOR_LIST_LENGTH.
+        """
+        authors = [FeedTimelineTests.author] + [
+            User.objects.create_user(username=f'listed_{number}')
+            for number in range(2)]
+        for author in authors:
+            for number in range(3):
+                Post.objects.create(author=author, text=f'Пост {number}')
+        author_ids = [author.pk for author in authors]
+        with mock.patch('posts.feeds.AUTHOR_LIST_LENGTH', 2):
+            with self.assertNumQueries(1):
+                lists = get_author_lists(author_ids)
+            with self.assertNumQueries(0):
+                self.assertEqual(get_author_lists(author_ids), lists)
+        for author in authors:
+            self.assertEqual(lists[author.pk], list(
+                Post.objects.filter(author=author).values_list(
+                    'created', 'pk')[:2]))
+
+    @override_settings(FEED_ENGINE='merge')
+    def test_merge_engine_falls_back_to_timeline(self):
+        """Ленту подписчика слишком многих авторов читают из базы."""
+        reader = FeedTimelineTests.reader
+        Follow.objects.create(user=reader, author=FeedTimelineTests.author)
+        Follow.objects.create(
+            user=reader, author=User.objects.create_user(username='extra'))
+        with mock.patch('posts.feeds.MERGE_AUTHORS_LIMIT', 1), \
+                mock.patch('posts.feeds.get_author_lists') as author_lists:
+            response = self.reader_client.get(reverse('posts:follow_index'))
+        author_lists.assert_not_called()
+        self.assertEqual(
+            list(response.context['page_obj']), [FeedTimelineTests.old_post])
+
+    @override_settings(FEED_ENGINE='merge')
+    def test_merge_engine_pages_match_timeline(self):
+        """
+        Лента, собранная слиянием списков авторов, совпадает с лентой из
+        базы, в том числе за пределами кэшированных списков.
+        """
+        author = FeedTimelineTests.author
+        reader = FeedTimelineTests.reader
+        second_author = User.objects.create_user(username='second_author')
+        Follow.objects.create(user=reader, author=author)
+        Follow.objects.create(user=reader, author=second_author)
+        for number in range(POSTS_LIMIT):
+            Post.objects.create(author=author, text=f'Первый {number}')
+            Post.objects.create(author=second_author, text=f'Второй {number}')
+        expected = list(Post.objects.filter(
+            author__in=(author, second_author)))
+
+        url = reverse('posts:follow_index')
+        with mock.patch('posts.feeds.AUTHOR_LIST_LENGTH', 3):
+            shown = []
+            response = self.reader_client.get(url)
+            while True:
+                page_obj = response.context['page_obj']
+                shown += list(page_obj)
+                if not page_obj.has_next():
+                    break
+                response = self.reader_client.get(
+                    f'{url}?after={page_obj.next_cursor}')
+            previous = self.reader_client.get(
+                f'{url}?before={page_obj.previous_cursor}')
+
+        self.assertEqual(shown, expected)
+        self.assertEqual(
+            list(previous.context['page_obj']), expected[POSTS_LIMIT:][
+                :POSTS_LIMIT])
+
+
+class CommentsPaginationTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='commentator')
+        cls.post = Post.objects.create(author=cls.user, text='Обсуждаемый')
+        for number in range(COMMENTS_LIMIT + OVER_POSTS_LIMIT):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий {number}')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_post_detail_shows_first_page_of_comments(self):
+        """
+        Страница поста показывает COMMENTS_LIMIT последних комментариев,
+        а следующая порция отдаётся фрагментом по курсору.
+        """
+        post = CommentsPaginationTests.post
+        response = self.guest_client.get(
+            reverse('posts:post_detail', args=(post.pk,)))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS_LIMIT)
+        self.assertTrue(comments.has_next())
+
+        fragment = self.guest_client.get(
+            reverse('posts:post_comments', args=(post.pk,))
+            + f'?after={comments.next_cursor}')
+        self.assertTemplateUsed(fragment, 'includes/comments.html')
+        self.assertEqual(len(fragment.context['comments']), OVER_POSTS_LIMIT)
+        self.assertFalse(fragment.context['comments'].has_next())
+        self.assertEqual(
+            list(comments) + list(fragment.context['comments']),
+            list(post.comments.order_by('-created', '-pk')))
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='validator')
+        cls.group = Group.objects.create(
+            title='Условная группа', slug='conditional', description='-')
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Неизменный пост')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(ConditionalGetTests.user)
+        post = ConditionalGetTests.post
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(post.group.slug,)),
+            reverse('posts:profile', args=(post.author.username,)),
+            reverse('posts:post_detail', args=(post.pk,)),
+        )
+
+    def test_unchanged_pages_return_not_modified(self):
+        """Совпавший ETag возвращает 304 без рендеринга страницы."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                etag = response['ETag']
+                with mock.patch('posts.views.render') as render:
+                    repeated = self.guest_client.get(
+                        url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(repeated.status_code, 304)
+                render.assert_not_called()
+                repeated = self.guest_client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(repeated.status_code, 304)
+
+    def test_changed_pages_are_sent_again(self):
+        """После новой записи или комментария ETag меняется."""
+        post = ConditionalGetTests.post
+        etags = {
+            url: self.guest_client.get(url)['ETag'] for url in self.urls}
+        Post.objects.create(
+            author=ConditionalGetTests.user, group=post.group, text='Новый')
+        Comment.objects.create(
+            post=post, author=ConditionalGetTests.user, text='Новый')
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etags[url])
+
+    def test_renamed_author_resends_post_page(self):
+        """После смены имени автора страница поста отдаётся заново."""
+        url = reverse(
+            'posts:post_detail', args=(ConditionalGetTests.post.pk,))
+        etag = self.guest_client.get(url)['ETag']
+        author = User.objects.get(pk=ConditionalGetTests.user.pk)
+        author.first_name = 'Фёдор'
+        author.save()
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Фёдор')
+
+    def test_cache_control(self):
+        """Анонимные страницы публичные, страницы пользователя - частные."""
+        url = self.urls[0]
+        guest = self.guest_client.get(url)['Cache-Control']
+        authorized = self.authorized_client.get(url)['Cache-Control']
+        self.assertIn('public', guest)
+        self.assertIn('must-revalidate', guest)
+        self.assertIn('private', authorized)
+        self.assertIn('no-cache', authorized)
+        self.assertNotEqual(
+            self.guest_client.get(url)['ETag'],
+            self.authorized_client.get(url)['ETag'])
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='searcher')
+        cls.cats = Post.objects.create(
+            author=cls.user, text='Котами и ёжиками полон дом')
+        cls.cat = Post.objects.create(
+            author=cls.user, text='Кот. Кот! Про кота и кошек')
+        cls.dogs = Post.objects.create(author=cls.user, text='Собаки')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        return self.guest_client.get(
+            reverse('posts:search'), {'q': query, **params})
+
+    def test_russian_word_forms_match(self):
+        """Поиск находит другие формы слова и не различает е и ё."""
+        response = self.search('кот')
+        self.assertEqual(
+            set(response.context['posts']),
+            {SearchTests.cats, SearchTests.cat})
+        self.assertEqual(
+            list(self.search('ежики').context['posts']), [SearchTests.cats])
+
+    def test_results_are_ranked(self):
+        """Пост с большим числом совпадений выше в выдаче."""
+        posts = self.search('кот').context['posts']
+        self.assertEqual(posts[0], SearchTests.cat)
+
+    def test_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при сохранении и удалении поста."""
+        dogs = SearchTests.dogs
+        dogs.text = 'Собаки и коты'
+        dogs.save()
+        self.assertIn(dogs, self.search('коты').context['posts'])
+        dogs.delete()
+        self.assertNotIn(dogs, self.search('коты').context['posts'])
+        self.assertEqual(list(self.search('собаки').context['posts']), [])
+
+    def test_keyset_pagination(self):
+        """Страницы результатов связаны курсором без пропусков."""
+        for number in range(POSTS_LIMIT):
+            Post.objects.create(
+                author=SearchTests.user, text=f'Кот номер {number}')
+        first = self.search('кот')
+        self.assertEqual(len(first.context['posts']), POSTS_LIMIT)
+        second = self.search('кот', after=first.context['next_cursor'])
+        self.assertIsNone(second.context['next_cursor'])
+        found = list(first.context['posts']) + list(second.context['posts'])
+        self.assertEqual(len(found), POSTS_LIMIT + 2)
+        self.assertEqual(len(set(found)), len(found))
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по тому же индексу."""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        client = Client()
+        client.force_login(admin)
+        response = client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'котов'})
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {SearchTests.cats, SearchTests.cat})
+
+
+class AutocompleteTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.anna = User.objects.create_user(username='anna')
+        cls.anton = User.objects.create_user(username='anton')
+        cls.boris = User.objects.create_user(username='boris')
+        Follow.objects.create(user=cls.boris, author=cls.anton)
+        cls.group = Group.objects.create(
+            title='Аниме', slug='anime', description='-')
+
+    def setUp(self):
+        prefix_index.clear()
+        self.guest_client = Client()
+
+    def complete(self, query):
+        return self.guest_client.get(
+            reverse('posts:autocomplete'), {'q': query}).json()
+
+    def test_users_are_ranked_by_followers(self):
+        """Пользователи с префиксом отдаются от самых популярных."""
+        users = self.complete('AN')['users']
+        self.assertEqual(
+            [user['username'] for user in users], ['anton', 'anna'])
+        self.assertEqual(users[0]['followers'], 1)
+        self.assertEqual(
+            users[0]['url'], reverse('posts:profile', args=('anton',)))
+
+    def test_groups_match_slug_and_title(self):
+        """Группа находится и по slug, и по названию."""
+        for query in ('ani', 'аним'):
+            with self.subTest(query=query):
+                groups = self.complete(query)['groups']
+                self.assertEqual([group['slug'] for group in groups], [
+                    'anime'])
+
+    def test_index_is_updated_by_signals(self):
+        """После построения индекс меняется сигналами без запросов к базе."""
+        self.complete('a')
+        User.objects.create_user(username='anfisa')
+        self.anna.username = 'hanna'
+        self.anna.save()
+        AutocompleteTests.group.delete()
+        with self.assertNumQueries(0):
+            found = prefix_index.search('an')
+        self.assertEqual(
+            sorted(ident for _, ident, _, _ in found),
+            ['anfisa', 'anton'])
+        self.assertEqual(len(prefix_index.search('hann')), 1)
+
+    def test_frequent_prefixes_are_ranked_by_followers(self):
+        """
+        Префикс, которому подходит больше AUTOCOMPLETE_SCAN ключей,
+        ранжируется по всем совпадениям, в том числе после изменений.
+        """
+        Follow.objects.create(user=self.anna, author=self.boris)
+        Follow.objects.create(user=self.anton, author=self.boris)
+        with mock.patch('posts.autocomplete.AUTOCOMPLETE_SCAN', 1):
+            self.assertEqual(
+                [user['username'] for user in self.complete('a')['users']],
+                ['anton', 'anna'])
+            prefix_index.add('user', 'andrei', 'andrei', 5)
+            self.assertEqual(
+                [ident for _, ident, _, _ in prefix_index.search('an')],
+                ['andrei', 'anton', 'anime', 'anna'])
+            prefix_index.remove('user', 'anton')
+            self.assertEqual(
+                [ident for _, ident, _, _ in prefix_index.search('an')],
+                ['andrei', 'anime', 'anna'])
+
+    @override_settings(BACKGROUND_JOBS_EAGER=False)
+    def test_index_is_refreshed_in_background(self):
+        """
+        Первый запрос строит индекс сам и отвечает верно, а устаревший
+        индекс перестраивается фоновым потоком.
+        """
+        with mock.patch('posts.autocomplete.Thread') as thread, \
+                mock.patch('posts.autocomplete._refreshing', False):
+            self.assertEqual(
+                [user['username'] for user in self.complete('an')['users']],
+                ['anton', 'anna'])
+            thread.assert_not_called()
+            prefix_index.built_at -= settings.AUTOCOMPLETE_REFRESH + 1
+            with self.assertNumQueries(0):
+                users = self.complete('an')['users']
+        self.assertEqual(
+            [user['username'] for user in users], ['anton', 'anna'])
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        with mock.patch('posts.jobs.transaction.on_commit') as commit:
+            self.post = Post.objects.create(
+                author=ThumbnailTests.user,
+                text='С картинкой',
+                image=SimpleUploadedFile(
+                    'photo.gif', SMALL_GIF, content_type='image/gif'),
+            )
+        self.scheduled = commit.call_count
+
+    def test_new_image_is_scheduled(self):
+        """Новая картинка ставится в очередь, правка текста - нет."""
+        self.assertEqual(self.scheduled, 1)
+        with mock.patch('posts.jobs.transaction.on_commit') as commit:
+            self.post.text = 'Новый текст'
+            self.post.save()
+        commit.assert_not_called()
+
+    def test_pages_never_create_thumbnails(self):
+        """
+        Страницы показывают исходную картинку, пока миниатюра не готова,
+        и не создают миниатюры сами.
+        """
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        with mock.patch(
+                'sorl.thumbnail.base.ThumbnailBackend._create_thumbnail'
+        ) as create:
+            response = self.guest_client.get(url)
+        create.assert_not_called()
+        self.assertContains(response, self.post.image.url)
+
+        generate_post_thumbnails(self.post.pk)
+        self.post.refresh_from_db()
+        variants = self.post.variants
+        self.assertIn('JPEG', variants)
+        for url in (url, reverse('posts:index')):
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, '<picture>')
+                for entries in variants.values():
+                    for width, height, name in entries:
+                        self.assertContains(
+                            response, f'{settings.MEDIA_URL}{name} {width}w')
+                self.assertNotContains(response, self.post.image.url)
+
+        Post.objects.filter(pk=self.post.pk).update(
+            image_variants='', modified=timezone.now())
+        cache.clear()
+        thumbnail = ready_thumbnail(self.post.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnail.url)
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_new_image_drops_old_variants(self):
+        """Варианты старой картинки сбрасываются при замене картинки."""
+        Post.objects.filter(pk=self.post.pk).update(
+            image_variants='{"JPEG": [[2, 1, "posts/old.jpg"]]}')
+        self.post.refresh_from_db()
+        self.post.text = 'Та же картинка'
+        self.post.save()
+        self.assertTrue(self.post.variants)
+        self.post.image = 'posts/other.gif'
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.variants, {})
+
+    def test_page_looks_thumbnails_up_in_bulk(self):
+        """Миниатюры всех карточек страницы ищутся одним запросом."""
+        for number in range(POSTS_LIMIT):
+            Post.objects.create(
+                author=ThumbnailTests.user, text=f'Пост {number}',
+                image=f'posts/missing_{number}.gif')
+        with CaptureQueriesContext(connection) as queries:
+            self.guest_client.get(reverse('posts:index'))
+        kvstore_queries = [
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']]
+        self.assertEqual(len(kvstore_queries), 1)
+
+
+TEMP_RESIZE_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, RESIZE_CACHE_DIR=TEMP_RESIZE_DIR)
+class ResizeTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.post = Post.objects.create(
+            author=User.objects.create_user(username='resizer'),
+            text='Картинка',
+            image=image_upload('photo.jpg', (100, 50), 'red'),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(TEMP_RESIZE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        shutil.rmtree(TEMP_RESIZE_DIR, ignore_errors=True)
+        self.guest_client = Client()
+        self.url = resize_url(ResizeTests.post.pk, 40, 20, crop=True)
+
+    def test_signed_urls_only(self):
+        """Чужая подпись или неверный размер дают 404."""
+        post = ResizeTests.post
+        for args in (
+                (post.pk, '40x20c', 'forged'),
+                (post.pk, '40x20', sign(post.pk, '40x20c')),
+                (post.pk, '9999x20', sign(post.pk, '9999x20'))):
+            with self.subTest(args=args):
+                response = self.guest_client.get(
+                    reverse('posts:resize_image', args=args))
+                self.assertEqual(response.status_code, 404)
+
+    def test_variant_is_rendered_once(self):
+        """Вариант создаётся при первом запросе и дальше берётся с диска."""
+        response = self.guest_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        image = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(image.size, (40, 20))
+        etag = response['ETag']
+
+        with mock.patch('posts.resize.render_variant') as render:
+            again = self.guest_client.get(self.url)
+            not_modified = self.guest_client.get(
+                self.url, HTTP_IF_NONE_MATCH=etag)
+        render.assert_not_called()
+        self.assertEqual(again['ETag'], etag)
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_concurrent_first_requests_wait_for_lock_holder(self):
+        """Пока вариант создаёт другой запрос, остальные ждут файл."""
+        post = ResizeTests.post
+        key = variant_key(post.image.name, '40x20c')
+        cache.add(f'resize:{key}:lock', 1)
+
+        def finish(seconds):
+            os.makedirs(os.path.dirname(variant_path(key)), exist_ok=True)
+            with open(variant_path(key), 'wb') as variant:
+                variant.write(b'ready')
+
+        with mock.patch('posts.resize.time.sleep', side_effect=finish), \
+                mock.patch('posts.resize.render_variant') as render:
+            response = self.guest_client.get(self.url)
+        render.assert_not_called()
+        self.assertEqual(b''.join(response.streaming_content), b'ready')
+
+    def test_evicted_variant_is_not_found(self):
+        """Вариант, удалённый сразу после создания, даёт 404, а не 500."""
+        with mock.patch(
+                'posts.views.get_variant',
+                return_value=(None, variant_path('evicted'))):
+            response = self.guest_client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_cache_is_bounded(self):
+        """При переполнении удаляются давно не запрошенные варианты."""
+        post = ResizeTests.post
+        paths = []
+        for width in (10, 20, 30):
+            self.guest_client.get(resize_url(post.pk, width, width))
+            path = variant_path(
+                variant_key(post.image.name, f'{width}x{width}'))
+            os.utime(path, (width, width))
+            paths.append(path)
+        sizes = [os.path.getsize(path) for path in paths]
+        evict(max_bytes=sum(sizes) - 1)
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[-1]))
+
+    def test_cache_size_is_counted_without_walking(self):
+        """
+        Размер кэша ведётся счётчиком: каталог обходится только для
+        первого подсчёта и при переполнении.
+        """
+        post = ResizeTests.post
+        self.guest_client.get(resize_url(post.pk, 10, 10))
+        first = cache.get('resize:bytes')
+        self.assertGreater(first, 0)
+        with mock.patch('posts.resize.os.walk') as walk:
+            self.guest_client.get(resize_url(post.pk, 20, 20))
+        walk.assert_not_called()
+        total = cache.get('resize:bytes')
+        self.assertGreater(total, first)
+
+        with self.settings(RESIZE_CACHE_MAX_BYTES=total):
+            self.guest_client.get(resize_url(post.pk, 30, 30))
+        self.assertLessEqual(cache.get('resize:bytes'), total)
+        self.assertFalse(os.path.exists(
+            variant_path(variant_key(post.image.name, '10x10'))))
@@ -0,0 +1,51 @@
+import os
+from contextlib import contextmanager
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+IMAGE_FORMATS = {'.gif': 'GIF', '.jpg': 'JPEG', '.png': 'PNG'}
+
+
+def image_content(size=(20, 10), color='green', image_format='PNG'):
+    """Содержимое файла картинки заданного размера и цвета."""
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def image_upload(name='photo.png', size=(20, 10), color='green'):
+    """Загружаемая картинка; формат берётся из расширения имени."""
+    image_format = IMAGE_FORMATS[os.path.splitext(name)[1].lower()]
+    return SimpleUploadedFile(
+        name, image_content(size, color, image_format),
+        content_type=f'image/{image_format.lower()}')
+
+
+class QueryBudgetMixin:
+    """Проверка того, что код укладывается в бюджет SQL-запросов."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget, msg=None):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}' for number, query in enumerate(
+                    context.captured_queries, start=1))
+            self.fail(self._formatMessage(msg, (
+                f'Выполнено {executed} запросов при бюджете {budget}:\n'
+                f'{queries}')))
@@ -0,0 +1,173 @@
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from .caching import bump_generations, post_generations
+from .jobs import defer
+from .models import Post
+
+
+class ThumbnailLookup(ThumbnailBackend):
+    """
+    Поиск готовой миниатюры без её создания. Имя файла и ключ хранилища
+    sorl считаются так же, как в ThumbnailBackend.get_thumbnail.
+    """
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_ready(self, file_, geometry_string, **options):
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options))
+
+    def get_ready_many(self, files, geometry_string, **options):
+        """
+        get_ready для списка картинок: один get_many к кэшу хранилища sorl
+        и один запрос к его таблице для промахов.
+        """
+        thumbnails = [
+            self.thumbnail_file(file_, geometry_string, **options)
+            for file_ in files]
+        kv_cache = getattr(default.kvstore, 'cache', None)
+        if kv_cache is None:
+            return [default.kvstore.get(thumbnail) for thumbnail in thumbnails]
+        keys = [add_prefix(thumbnail.key) for thumbnail in thumbnails]
+        raw = kv_cache.get_many(keys)
+        missing = [key for key in keys if key not in raw]
+        if missing:
+            stored = dict(KVStore.objects.filter(
+                key__in=missing).values_list('key', 'value'))
+            fetched = {key: stored.get(key, EMPTY_VALUE) for key in missing}
+            kv_cache.set_many(
+                fetched, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+            raw.update(fetched)
+        return [
+            None if raw[key] == EMPTY_VALUE else deserialize_image_file(
+                raw[key]) for key in keys]
+
+
+lookup = ThumbnailLookup()
+
+
+def ready_thumbnail(image, size):
+    """Готовая миниатюра размера size из POST_THUMBNAIL_SIZES или None."""
+    if not image:
+        return None
+    geometry, options = settings.POST_THUMBNAIL_SIZES[size]
+    return lookup.get_ready(image, geometry, **options)
+
+
+def prefetch_thumbnails(posts):
+    """
+    Находит готовые миниатюры всех размеров для постов страницы и
+    сохраняет их в post.thumbnails: {размер: миниатюра или None}.
+    """
+    posts = list(posts)
+    for post in posts:
+        post.thumbnails = {}
+    with_images = [
+        post for post in posts if post.image and not post.image_variants]
+    if not with_images:
+        return
+    for size, (geometry, options) in settings.POST_THUMBNAIL_SIZES.items():
+        ready = lookup.get_ready_many(
+            [post.image for post in with_images], geometry, **options)
+        for post, thumbnail in zip(with_images, ready):
+            post.thumbnails[size] = thumbnail
+
+
+def variant_formats():
+    """Форматы из POST_IMAGE_FORMATS, которые умеет записывать Pillow."""
+    Image.init()
+    return [
+        (image_format, options)
+        for image_format, options in settings.POST_IMAGE_FORMATS
+        if image_format in Image.SAVE]
+
+
+def generate_variants(image):
+    """
+    Варианты картинки для srcset: кадр карточки нужной ширины в каждом
+    формате. Узкие картинки не растягиваются, поэтому повторяющиеся
+    ширины пропускаются.
+    """
+    card_geometry, _ = settings.POST_THUMBNAIL_SIZES['card']
+    card_width, card_height = (
+        int(side) for side in card_geometry.split('x'))
+    variants = {}
+    for image_format, options in variant_formats():
+        found = {}
+        for width in settings.POST_IMAGE_WIDTHS:
+            height = round(width * card_height / card_width)
+            thumbnail = get_thumbnail(
+                image, f'{width}x{height}', crop='center', upscale=False,
+                format=image_format, **options)
+            if not thumbnail.size:
+                # Исходника нет в хранилище: sorl вернул пустую миниатюру.
+                continue
+            found.setdefault(
+                thumbnail.width, [
+                    thumbnail.width, thumbnail.height, thumbnail.name])
+        if found:
+            variants[image_format] = sorted(found.values())
+    return variants
+
+
+def generate_post_thumbnails(post_id):
+    """
+    Создаёт все миниатюры и адаптивные варианты картинки поста,
+    записывает варианты в пост и обновляет его карточку и страницы.
+    """
+    post = Post.objects.select_related('author', 'group').filter(
+        pk=post_id).first()
+    if post is None or not post.image:
+        return
+    for geometry, options in settings.POST_THUMBNAIL_SIZES.values():
+        get_thumbnail(post.image, geometry, **options)
+    variants = generate_variants(post.image)
+    Post.objects.filter(pk=post_id, image=post.image.name).update(
+        image_variants=json.dumps(variants) if variants else '',
+        modified=timezone.now())
+    bump_generations(*post_generations(post))
+
+
+def share_variants(post):
+    """
+    Берёт варианты у другого поста с тем же файлом картинки. Миниатюры
+    у них общие, поэтому создавать их заново не нужно.
+    """
+    variants = Post.objects.filter(image=post.image.name).exclude(
+        pk=post.pk).exclude(image_variants='').values_list(
+            'image_variants', flat=True).first()
+    if not variants:
+        return False
+    Post.objects.filter(pk=post.pk).update(image_variants=variants)
+    post.image_variants = variants
+    return True
+
+
+def schedule_thumbnails(post):
+    """Ставит создание миниатюр в фоновую очередь после коммита."""
+    defer(
+        generate_post_thumbnails, post.pk, pool='thumbnails',
+        workers=settings.THUMBNAIL_WORKERS)
@@ -0,0 +1,144 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.uploadhandler import (
+    StopUpload, TemporaryFileUploadHandler)
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Сколько первых байт загрузки хватает, чтобы прочитать заголовок
+# картинки: у JPEG перед размерами может идти блок EXIF до 64 КБ.
+HEADER_BYTES = 64 * 1024
+
+INVALID_IMAGE = (
+    'Загрузите правильное изображение. Файл, который вы загрузили, '
+    'поврежден или не является изображением.')
+
+
+class ImageRejected(Exception):
+    pass
+
+
+def inspect_image(file):
+    """
+    Открывает картинку по заголовку, не декодируя её, и проверяет формат
+    и размеры. Возвращает объект Pillow с незагруженными пикселями.
+    """
+    try:
+        image = Image.open(file)
+    except Image.DecompressionBombError:
+        raise ImageRejected(size_error())
+    except (OSError, SyntaxError, ValueError):
+        raise ImageRejected(INVALID_IMAGE)
+    check_image(image)
+    return image
+
+
+def check_image(image):
+    """Проверяет формат и размеры открытой картинки Pillow."""
+    if image.format not in settings.POST_IMAGE_UPLOAD_FORMATS:
+        raise ImageRejected(
+            'Допустимые форматы: {}.'.format(
+                ', '.join(settings.POST_IMAGE_UPLOAD_FORMATS)))
+    width, height = image.size
+    if (max(width, height) > settings.POST_IMAGE_MAX_SIDE
+            or width * height > settings.POST_IMAGE_MAX_PIXELS):
+        raise ImageRejected(size_error())
+
+
+def size_error():
+    return (
+        'Картинка слишком большая: не больше {side} пикселей по стороне '
+        'и {megapixels} мегапикселей.'.format(
+            side=settings.POST_IMAGE_MAX_SIDE,
+            megapixels=settings.POST_IMAGE_MAX_PIXELS // 10 ** 6))
+
+
+def image_size(field_file):
+    """
+    Ширина и высота картинки по заголовку файла; (None, None), если файл
+    не читается. Загрузка, уже проверенная формой, повторно не читается.
+    """
+    if not field_file:
+        return None, None
+    image = getattr(getattr(field_file, '_file', None), 'image', None)
+    if image is not None:
+        return image.size
+    try:
+        field_file.open('rb')
+        try:
+            return Image.open(field_file).size
+        finally:
+            if field_file._committed:
+                field_file.close()
+            else:
+                field_file.seek(0)
+    except (OSError, SyntaxError, ValueError, SuspiciousFileOperation,
+            Image.DecompressionBombError):
+        return None, None
+
+
+def upload_errors(request):
+    """Ошибки загрузок запроса по именам полей из LimitedUploadHandler."""
+    return getattr(request, 'upload_errors', {})
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """
+    Пишет загрузки во временный файл и останавливает разбор запроса, как
+    только файл превысил POST_IMAGE_MAX_BYTES или его заголовок не прошёл
+    inspect_image: остаток тела запроса не читается. Текст ошибки
+    остаётся в request.upload_errors, и PostForm показывает его у поля.
+    Все загрузки сайта - картинки постов.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = BytesIO()
+        self.checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.POST_IMAGE_MAX_BYTES:
+            self.reject('Файл больше {}.'.format(
+                filesizeformat(settings.POST_IMAGE_MAX_BYTES)))
+            raise StopUpload(connection_reset=True)
+        if not self.checked:
+            self.head.write(raw_data)
+            if (self.head.tell() >= HEADER_BYTES
+                    and not self.check_header(complete=False)):
+                raise StopUpload(connection_reset=True)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.checked and not self.check_header(complete=True):
+            # Файл уже прочитан целиком: его просто нет среди загрузок,
+            # а поля после него разбираются как обычно.
+            self.file.close()
+            return None
+        return super().file_complete(file_size)
+
+    def check_header(self, complete):
+        """Проверяет заголовок картинки; False, если файл отклонён."""
+        self.checked = True
+        self.head.seek(0)
+        try:
+            inspect_image(self.head)
+        except ImageRejected as error:
+            # Заголовок может не поместиться в начало файла: тогда его
+            # проверит форма, когда файл будет загружен целиком.
+            message = str(error)
+            if complete or message != INVALID_IMAGE:
+                self.reject(message)
+                return False
+        finally:
+            self.head = None
+        return True
+
+    def reject(self, message):
+        if not hasattr(self.request, 'upload_errors'):
+            self.request.upload_errors = {}
+        self.request.upload_errors[self.field_name] = message
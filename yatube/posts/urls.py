@@ -21,6 +21,9 @@ urlpatterns = [
 
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
 
+    path('posts/<int:post_id>/comments/', (
+        views.post_comments), name='post_comments'),
+
     path('posts/<int:post_id>/comment/', (
         views.add_comment), name='add_comment'),
 
@@ -29,4 +32,11 @@ urlpatterns = [
     path('create/', views.post_create, name='post_create'),
 
     path('follow/', views.follow_index, name='follow_index'),
+
+    path('search/', views.search, name='search'),
+
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+
+    path('resize/<int:post_id>/<str:spec>/<str:signature>/', (
+        views.resize_image), name='resize_image'),
 ]
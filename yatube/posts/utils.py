@@ -1,12 +1,141 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .counts import get_count
 
 
 POSTS_LIMIT = 10
+COMMENTS_LIMIT = 20
+
+
+def encode_cursor(obj):
+    """Непрозрачный токен позиции записи в ленте: (created, id)."""
+    raw = f'{obj.created.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        created, pk = parse_datetime(created), int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+    if created is None:
+        return None
+    return created, pk
+
+
+class KeysetPage(Page):
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        # У пустой страницы нет курсоров, а значит и ссылок с неё.
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+        self.next_cursor = encode_cursor(object_list[-1]) if (
+            self._has_next) else None
+        self.previous_cursor = encode_cursor(object_list[0]) if (
+            self._has_previous) else None
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+
+class KeysetPaginator(Paginator):
+    """
+    Постраничный вывод по ключу (created, id) вместо OFFSET: стоимость
+    страницы не зависит от её глубины и не требует COUNT(*).
+    """
+
+    keyset = True
 
+    def fetch(self, cursor, forward, limit):
+        created, pk = cursor or (None, None)
+        queryset = self.object_list
+        if forward:
+            if cursor:
+                queryset = queryset.filter(
+                    Q(created__lt=created) | Q(created=created, pk__lt=pk))
+            return list(queryset.order_by('-created', '-pk')[:limit])
+        queryset = queryset.filter(
+            Q(created__gt=created) | Q(created=created, pk__gt=pk))
+        return list(queryset.order_by('created', 'pk')[:limit])[::-1]
 
-def get_page_obj(queryset, request):
+    def keyset_page(self, after=None, before=None):
+        limit = self.per_page + 1
+        if before:
+            rows = self.fetch(before, False, limit)
+            has_previous = len(rows) > self.per_page
+            return KeysetPage(
+                rows[-self.per_page:], self, True, has_previous)
+        rows = self.fetch(after, True, limit)
+        has_next = len(rows) > self.per_page
+        return KeysetPage(
+            rows[:self.per_page], self, has_next, after is not None)
 
-    paginator = Paginator(queryset, POSTS_LIMIT)
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator, берущий число записей из счётчика (count) или из кэша
+    счётчиков (count_scope), а не из COUNT(*).
+    """
+
+    def __init__(self, object_list, per_page, count_scope=None, count=None,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_scope = count_scope
+        self.known_count = count
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        return get_count(self.count_scope, self.object_list)
+
+
+LIST_RELATED = ('author', 'group')
+
+
+def get_page_obj(queryset, request, count_scope=None, count=None):
+
+    queryset = queryset.select_related(*LIST_RELATED)
+
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+
+    if after or before:
+        paginator = KeysetPaginator(queryset, POSTS_LIMIT)
+        return paginator.keyset_page(after=after, before=before)
+
+    if count_scope is None and count is None:
+        paginator = Paginator(queryset, POSTS_LIMIT)
+    else:
+        paginator = CachedCountPaginator(
+            queryset, POSTS_LIMIT, count_scope=count_scope, count=count)
     page_number = request.GET.get('page')
 
-    return paginator.get_page(page_number)
+    page_obj = paginator.get_page(page_number)
+    objects = page_obj.object_list = list(page_obj.object_list)
+    page_obj.next_cursor = encode_cursor(objects[-1]) if (
+        page_obj.has_next() and objects) else None
+    page_obj.previous_cursor = encode_cursor(objects[0]) if (
+        page_obj.has_previous() and objects) else None
+    return page_obj
+
+
+def get_comments_page(queryset, request):
+    paginator = KeysetPaginator(
+        queryset.select_related('author'), COMMENTS_LIMIT)
+    return paginator.keyset_page(
+        after=decode_cursor(request.GET.get('after')))
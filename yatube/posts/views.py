@@ -1,29 +1,51 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import redirect, render, get_object_or_404
-from django.views.decorators.cache import cache_page
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from .autocomplete import USER, get_prefix_index
+from .caching import (
+    INDEX_GENERATION, PAGE_CACHE_TIMEOUT, cache_by_generation,
+    get_generations, group_generation, profile_generation)
+from .conditional import (
+    conditional_page, group_validators, index_validators, post_validators,
+    profile_validators)
+from .counts import INDEX_SCOPE, get_user_stats
+from .feeds import get_feed_page, get_merged_feed_page
 from .forms import PostForm, CommentForm
 from .models import Post, Group, Follow
-from .utils import get_page_obj
+from .resize import check_signature, get_variant, parse_spec, variant_key
+from .search import decode_search_cursor, search_posts
+from .thumbnails import prefetch_thumbnails
+from .uploads import upload_errors
+from .utils import get_comments_page, get_page_obj
 
 User = get_user_model()
 
 
-@cache_page(20)
+@conditional_page(index_validators)
+@cache_by_generation(PAGE_CACHE_TIMEOUT, INDEX_GENERATION)
 def index(request):
 
-    page_obj = get_page_obj(Post.objects.all(), request)
+    page_obj = get_page_obj(Post.objects.all(), request, INDEX_SCOPE)
 
     context = {
         'page_obj': page_obj,
+        'generation': get_generations(INDEX_GENERATION)[0],
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(group_validators)
+@cache_by_generation(PAGE_CACHE_TIMEOUT, group_generation('{slug}'))
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
 
-    page_obj = get_page_obj(group.posts_grp.all(), request)
+    page_obj = get_page_obj(
+        group.posts_grp.all(), request, count=group.posts_count)
 
     context = {
         'group': group,
@@ -32,30 +54,37 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(profile_validators)
+@cache_by_generation(PAGE_CACHE_TIMEOUT, profile_generation('{username}'))
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-
-    posts_count = author.posts_usr.all().count()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    stats = get_user_stats(author)
 
-    page_obj = get_page_obj(author.posts_usr.all(), request)
+    page_obj = get_page_obj(
+        author.posts_usr.all(), request, count=stats.posts_count)
 
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user, author=author).exists()
 
     context = {
         'page_obj': page_obj,
-        'posts_count': posts_count,
+        'posts_count': stats.posts_count,
+        'stats': stats,
         'author': author,
         'following': following,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(post_validators)
 def post_detail(request, post_id):
-    post_obj = get_object_or_404(Post, pk=post_id)
-    posts_count = Post.objects.filter(author_id=post_obj.author_id).count()
+    post_obj = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id)
+    posts_count = get_user_stats(post_obj.author).posts_count
+    prefetch_thumbnails([post_obj])
     form = CommentForm()
-    comments = post_obj.comments.all()
+    comments = get_comments_page(post_obj.comments.all(), request)
 
     context = {
         'post_obj': post_obj,
@@ -66,12 +95,84 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    post_obj = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = get_comments_page(post_obj.comments.all(), request)
+
+    context = {
+        'post_obj': post_obj,
+        'comments': comments,
+    }
+    return render(request, 'includes/comments.html', context)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts, next_cursor = search_posts(
+        query, after=decode_search_cursor(request.GET.get('after')))
+
+    context = {
+        'query': query,
+        'posts': posts,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def autocomplete(request):
+    found = get_prefix_index().search(request.GET.get('q', '').strip())
+    users, groups = [], []
+    for kind, ident, label, rank in found:
+        if kind == USER:
+            users.append({
+                'username': ident,
+                'followers': rank,
+                'url': reverse('posts:profile', args=(ident,)),
+            })
+        else:
+            groups.append({
+                'slug': ident,
+                'title': label,
+                'posts': rank,
+                'url': reverse('posts:group_list', args=(ident,)),
+            })
+    return JsonResponse({'users': users, 'groups': groups})
+
+
+def resize_image(request, post_id, spec, signature):
+    if not parse_spec(spec) or not check_signature(post_id, spec, signature):
+        raise Http404
+    post = get_object_or_404(Post.objects.only('image'), pk=post_id)
+    if not post.image:
+        raise Http404
+
+    etag = quote_etag(variant_key(post.image.name, spec))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            _, path = get_variant(post.image, spec)
+            # Вариант могла вытеснить evict() из другого запроса.
+            variant = open(path, 'rb')
+        except OSError:
+            raise Http404
+        response = FileResponse(variant, content_type='image/jpeg')
+    response['ETag'] = etag
+    patch_cache_control(
+        response, public=True, max_age=settings.RESIZE_BROWSER_CACHE)
+    return response
+
+
 @login_required
 def post_create(request):
     group_option = Group.objects.all()
-    user = get_object_or_404(User, username=request.user)
-
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    # Если загрузку отклонили, разбор запроса остановлен и полей после
+    # файла нет: форма всё равно связана, чтобы показать ошибку.
+    is_post = request.method == 'POST'
+    form = PostForm(
+        request.POST if is_post else None,
+        files=request.FILES if is_post else None,
+        upload_errors=upload_errors(request),
+    )
 
     title = 'Добавить запись'
 
@@ -86,7 +187,7 @@ def post_create(request):
 
     if form.is_valid():
         temp_form = form.save(commit=False)
-        temp_form.author = user
+        temp_form.author = request.user
         temp_form.save()
 
         return redirect('posts:profile', username=request.user)
@@ -106,13 +207,15 @@ def post_edit(request, post_id):
     is_edit = True
     title = 'Редактировать запись'
 
-    if post.author != request.user:
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post_id=post_id)
 
+    is_post = request.method == 'POST'
     form = PostForm(
-        request.POST or None,
-        files=request.FILES or None,
-        instance=post
+        request.POST if is_post else None,
+        files=request.FILES if is_post else None,
+        instance=post,
+        upload_errors=upload_errors(request),
     )
 
     if form.is_valid():
@@ -142,12 +245,10 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    current_user = request.user
-
-    authors = list(current_user.follower.values_list('author', flat=True))
-
-    page_obj = get_page_obj(
-        Post.objects.filter(author_id__in=authors), request)
+    if settings.FEED_ENGINE == 'merge':
+        page_obj = get_merged_feed_page(request.user, request)
+    else:
+        page_obj = get_feed_page(request.user, request)
 
     context = {
         'page_obj': page_obj,
@@ -168,5 +269,6 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
-    Follow.objects.get(user=user, author=author).delete()
+    Follow.objects.select_related('user', 'author').get(
+        user=user, author=author).delete()
     return redirect('posts:profile', username=username)
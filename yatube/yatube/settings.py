@@ -141,8 +141,94 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Общий для воркеров кэш (L2) хранится в базе SQLite в каталоге
+# YATUBE_CACHE_DIR; без него (локально и в тестах) его заменяет кэш в
+# памяти процесса.
+CACHE_DIR = os.environ.get('YATUBE_CACHE_DIR')
+
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache.TwoTierCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_TIMEOUT': 5,
+            'L1_MAX_ENTRIES': 1000,
+            'L1_BYPASS': ('generation:',),
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'cache.sqlite3'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_EVERY': 100,
+        },
+    } if CACHE_DIR else {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'LOCATION': 'shared',
+    },
+}
+
+# Авторы, у которых подписчиков не меньше порога, не раскладывают посты по
+# лентам подписчиков: их посты подмешиваются в ленту при чтении.
+FEED_PULL_THRESHOLD = 10000
+FEED_PULL_HYSTERESIS = 0.9
+
+# Способ сборки ленты подписок: 'timeline' - чтение материализованной ленты,
+# 'merge' - слияние кэшированных списков постов каждого автора.
+FEED_ENGINE = 'timeline'
+
+# Фоновые задачи (posts.jobs): создание миниатюр, перестроение индекса
+# автодополнения, заполнение лент. Они выполняются в пулах потоков после
+# коммита. С BACKGROUND_JOBS_EAGER - сразу в текущем потоке: его включают
+# тесты, чтобы задачи не пережили тест и его базу.
+BACKGROUND_WORKERS = 2
+BACKGROUND_JOBS_EAGER = False
+
+TEST_RUNNER = 'core.test_runner.EagerJobsRunner'
+
+# Индекс автодополнения живёт в памяти каждого воркера: изменения из
+# сигналов своего процесса видны сразу, а из других воркеров и новые
+# значения счётчиков - после перестроения раз в AUTOCOMPLETE_REFRESH секунд.
+# Перестраивается индекс в фоновом потоке, не задерживая запросы.
+AUTOCOMPLETE_REFRESH = 300
+
+# Размеры миниатюр картинок постов: имя -> (геометрия sorl, параметры).
+# Миниатюры создаются в фоне после сохранения поста, до этого шаблоны
+# показывают исходную картинку.
+POST_THUMBNAIL_SIZES = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
 }
+THUMBNAIL_WORKERS = 2
+
+# Движок sorl-thumbnail с быстрым декодированием больших картинок и
+# уровень качества масштабирования: 'fast', 'balanced' или 'best'.
+THUMBNAIL_ENGINE = 'posts.thumbnail_engine.Engine'
+THUMBNAIL_RESAMPLE = 'balanced'
+
+# Загрузка картинок постов: файлы пишутся во временный файл, и запись
+# обрывается на POST_IMAGE_MAX_BYTES или на заголовке неподходящей картинки.
+FILE_UPLOAD_HANDLERS = ['posts.uploads.LimitedUploadHandler']
+POST_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+POST_IMAGE_UPLOAD_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+POST_IMAGE_MAX_SIDE = 8000
+POST_IMAGE_MAX_PIXELS = 40 * 10 ** 6
+
+# Адаптивные варианты картинок постов: ширины для srcset и форматы от
+# предпочтительного к запасному (последний идёт в <img>). Форматы, которые
+# не умеет записывать установленный Pillow, пропускаются.
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+POST_IMAGE_FORMATS = (
+    ('WEBP', {'quality': 75}),
+    ('JPEG', {'quality': 80, 'progressive': True}),
+)
+
+# Картинки произвольного размера (/resize/...): каталог дискового кэша,
+# его предельный размер в байтах, наибольшая сторона картинки и время
+# хранения ответа в браузере (после него браузер перепроверяет ETag).
+RESIZE_CACHE_DIR = os.environ.get(
+    'YATUBE_RESIZE_DIR', os.path.join(BASE_DIR, 'resize_cache'))
+RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RESIZE_MAX_SIDE = 2000
+RESIZE_BROWSER_CACHE = 60 * 60 * 24
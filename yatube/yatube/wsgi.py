@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# Индекс автодополнения готов до первого запроса воркера.
+from posts.autocomplete import warm_prefix_index  # noqa: E402
+
+warm_prefix_index()